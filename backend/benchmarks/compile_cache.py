@@ -0,0 +1,101 @@
+"""Сравнение попаданий в кэш компиляции SQLAlchemy: ручной select() с in_() против SelectBuilder.
+
+    cd backend && python -m benchmarks.compile_cache [--calls 5000] [--url postgresql+asyncpg://...]
+
+Без --url кэш компиляции моделируется локально (ключ кэша -> скомпилированный запрос),
+с --url запросы выполняются на базе и считаются по событиям движка (sql_profiler.compiled_cache)
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql.asyncpg import dialect as asyncpg_dialect
+
+from services.ai_service.core.db_models import Chat
+from shared.db.query_builder import SelectBuilder
+from shared.db.profiler import sql_profiler
+
+
+def random_filters(rnd: random.Random) -> dict:
+    return {
+        "user_ids": rnd.sample(range(1, 10000), rnd.randint(1, 50)) if rnd.random() < 0.7 else None,
+        "chat_ids": rnd.sample(range(1, 100000), rnd.randint(1, 20)) if rnd.random() < 0.5 else None,
+        "existing": rnd.choice([True, True, False, None]),
+    }
+
+
+def manual_select(user_ids, chat_ids, existing):
+    stmt = select(Chat)
+    if user_ids is not None:
+        stmt = stmt.where(Chat.user_id.in_(user_ids))
+    if chat_ids is not None:
+        stmt = stmt.where(Chat.chat_id.in_(chat_ids))
+    if existing is True:
+        stmt = stmt.where(Chat.delete_timestamp == None)
+    elif existing is False:
+        stmt = stmt.where(Chat.delete_timestamp != None)
+    return stmt, {}
+
+
+def builder_select(user_ids, chat_ids, existing):
+    query = SelectBuilder(Chat).any_(Chat.user_id, user_ids).any_(Chat.chat_id, chat_ids).existing(existing)
+    return query.statement, query.params
+
+
+def simulate(build, calls: list[dict]) -> dict:
+    dialect = asyncpg_dialect()
+    cache = {}
+    hits = 0
+    start = time.perf_counter()
+    for filters in calls:
+        stmt, _ = build(**filters)
+        key = stmt._generate_cache_key()
+        if key in cache:
+            hits += 1
+        else:
+            cache[key] = stmt.compile(dialect=dialect)
+    elapsed = time.perf_counter() - start
+    return {"hit_rate": hits / len(calls), "cache_entries": len(cache), "us_per_call": elapsed / len(calls) * 1e6}
+
+
+async def run_on_database(url: str, build, calls: list[dict]) -> dict:
+    from shared.db.sql_database import Database
+
+    db = Database(engines_params=[{"name": "benchmark", "url": url}])
+    session = await db.get_scoped_session("benchmark")
+    sql_profiler.compiled_cache.clear()
+    start = time.perf_counter()
+    for filters in calls:
+        stmt, params = build(**filters)
+        await session.execute(stmt, params)
+    elapsed = time.perf_counter() - start
+    await session.rollback()
+    await session.close()
+    return {
+        "hit_rate": sql_profiler.compiled_cache_hit_rate,
+        "compiled_cache": dict(sql_profiler.compiled_cache),
+        "us_per_call": elapsed / len(calls) * 1e6
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", default=None)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    calls = [random_filters(rnd) for _ in range(args.calls)]
+    for name, build in (("manual select + in_()", manual_select), ("SelectBuilder", builder_select)):
+        if args.url:
+            result = asyncio.run(run_on_database(args.url, build, calls))
+        else:
+            result = simulate(build, calls)
+        print(f"{name:24} {result}")
+
+
+if __name__ == "__main__":
+    main()
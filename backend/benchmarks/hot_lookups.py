@@ -0,0 +1,82 @@
+"""Сравнение ORM select(Model).mappings() и Database.fetch (asyncpg напрямую) на запросе баланса пользователя.
+
+    cd backend && python -m benchmarks.hot_lookups --url postgresql+asyncpg://... [--calls 2000] [--user-id 1]
+
+Для каждого пути выводятся p50/p95 задержки и пиковый объем выделенной за вызов памяти (tracemalloc)
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+
+from sqlalchemy import select
+
+from services.ai_service.core.db_models import UserBalance, UserBalanceRow
+from shared.db.sql_database import Database
+
+DB_NAME = "benchmark"
+
+
+async def orm_lookup(db: Database, user_id: int):
+    stmt = select(UserBalance).where((UserBalance.user_id == user_id) & (UserBalance.delete_timestamp == None))
+    result = (await (await db.sessions)[DB_NAME].execute(stmt)).mappings().one_or_none()
+    return result["UserBalance"] if result else None
+
+
+async def raw_lookup(db: Database, user_id: int):
+    query = f"""
+        SELECT user_balance_id, user_id, balance
+        FROM {UserBalance.__tablename__}
+        WHERE user_id = $1 AND delete_timestamp IS NULL
+    """
+    return await db.fetchrow(query, DB_NAME, user_id, row_factory=UserBalanceRow)
+
+
+async def measure(db: Database, lookup, user_id: int, calls: int) -> dict:
+    for _ in range(min(100, calls)):
+        await lookup(db, user_id)
+
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await lookup(db, user_id)
+        latencies.append(time.perf_counter() - start)
+
+    # пиковый прирост памяти за вызов - объем временных объектов (Row, ORM объекты, словари)
+    tracemalloc.start()
+    peaks = []
+    for _ in range(calls):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        await lookup(db, user_id)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "p50_us": statistics.median(latencies) * 1e6,
+        "p95_us": latencies[int(len(latencies) * 0.95)] * 1e6,
+        "peak_alloc_bytes_per_call": statistics.mean(peaks),
+    }
+
+
+async def run(url: str, user_id: int, calls: int):
+    db = Database(engines_params=[{"name": DB_NAME, "url": url}])
+    for name, lookup in (("ORM select + mappings", orm_lookup), ("Database.fetch", raw_lookup)):
+        print(f"{name:24} {await measure(db, lookup, user_id, calls)}")
+    await (await db.sessions)[DB_NAME].rollback()
+    await (await db.sessions)[DB_NAME].close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", required=True)
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.user_id, args.calls))
+
+
+if __name__ == "__main__":
+    main()
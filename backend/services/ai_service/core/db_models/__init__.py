@@ -1,4 +1,6 @@
+from dataclasses import dataclass
 from datetime import datetime
+from typing import Optional
 
 from sqlalchemy import MetaData, Integer, DateTime, String, ForeignKey, Text, Boolean
 from sqlalchemy.orm import declarative_base, mapped_column, Mapped
@@ -73,6 +75,8 @@ class File(MyBase):
     file_size: Mapped[str] = mapped_column("file_size", Integer, nullable=False) # file size in bytes
     mimetype: Mapped[str] = mapped_column("mimetype", String(256), nullable=False)
     user_id: Mapped[int] = mapped_column("user_id", Integer, nullable=False)
+    content_hash: Mapped[Optional[str]] = mapped_column("content_hash", String(64), nullable=True, default=None,
+                                                        index=True)  # sha256 содержимого, s3_key общий у копий
     create_timestamp: Mapped[datetime] = mapped_column("create_timestamp", DateTime(timezone=False), nullable=False,
                                                        default=datetime.now())
     delete_timestamp: Mapped[datetime] = mapped_column("delete_timestamp", DateTime(timezone=False), nullable=True,
@@ -111,4 +115,22 @@ class UserBalance(MyBase):
     create_timestamp: Mapped[datetime] = mapped_column("create_timestamp", DateTime(timezone=False), nullable=False,
                                                        default=datetime.now())
     delete_timestamp: Mapped[datetime] = mapped_column("delete_timestamp", DateTime(timezone=False), nullable=True,
-                                                       default=None)
\ No newline at end of file
+                                                       default=None)
+
+
+# Легковесные строки для быстрого пути Database.fetch (без ORM объектов), порядок полей = порядок колонок запроса
+
+@dataclass(slots=True)
+class ChatRow:
+    chat_id: int
+    language: str
+    user_id: int
+    create_timestamp: datetime
+    delete_timestamp: Optional[datetime]
+
+
+@dataclass(slots=True)
+class UserBalanceRow:
+    user_balance_id: int
+    user_id: int
+    balance: int
@@ -19,6 +19,7 @@ class ChatRead(BaseDTO):
 
 class ChatsRead(BaseDTO):
     items: tp.List[ChatRead]
+    next_cursor: tp.Optional[str] = None
 
 
 class MessageDataCreateUpdate(BaseDTO):
@@ -6,8 +6,9 @@ from authlib.jose import JsonWebKey
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncEngine
 
+from shared.db.sharding import interleave_sequences
 from shared.db.sql_database import Database
-from ..db_models import MyBase, Chat, Message, MessageData, MessageDataXFile
+from ..db_models import MyBase, Chat, Message, MessageData, MessageDataXFile, File
 from ..settings import settings
 
 
@@ -16,6 +17,8 @@ async def init():
     await db.run_sync_batch(MyBase.metadata.create_all)
     for engine in (await db.get_engines()).values():
         await raw_sql_scripts_init(engine=engine)
+    await interleave_sequences(db=db, shard_names=settings.ai_db_settings.shard_names)
+    await db.load_schema()
 
 
 async def raw_sql_scripts_init(engine: AsyncEngine):
@@ -23,6 +26,13 @@ async def raw_sql_scripts_init(engine: AsyncEngine):
 
         # =================================================================
 
+        # create_all не меняет существующие таблицы
+        table_name = File.__tablename__
+        await conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)"))
+        await conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table_name}_content_hash ON {table_name} (content_hash)"))
+
+        # =================================================================
+
         table_name = Chat.__tablename__
         function_name = f"trigger_on_{table_name}"
         query = f"""
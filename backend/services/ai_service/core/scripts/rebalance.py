@@ -0,0 +1,68 @@
+import asyncio
+import sys
+
+from sqlalchemy import select, insert, delete, union
+
+from shared.db.sharding import ShardMap
+from shared.db.sql_database import Database
+from ..db_models import Chat, Message, MessageData, MessageDataXFile, File, FileXCompany, UserBalance
+from ..settings import settings
+
+
+def user_rows(user_id: int) -> list:
+    """Выборки строк пользователя по таблицам в порядке внешних ключей (родители раньше детей)"""
+    chat_ids = select(Chat.chat_id).where(Chat.user_id == user_id)
+    message_ids = select(Message.message_id).where(Message.chat_id.in_(chat_ids))
+    message_data_ids = select(MessageData.message_data_id).where(MessageData.message_id.in_(message_ids))
+    file_ids = select(File.file_id).where(File.user_id == user_id)
+    return [
+        (UserBalance, UserBalance.user_id == user_id),
+        (Chat, Chat.user_id == user_id),
+        (Message, Message.message_id.in_(message_ids)),
+        (MessageData, MessageData.message_data_id.in_(message_data_ids)),
+        (File, File.file_id.in_(file_ids)),
+        (FileXCompany, FileXCompany.file_id.in_(file_ids)),
+        (MessageDataXFile, MessageDataXFile.message_data_id.in_(message_data_ids)),
+    ]
+
+
+async def move_user(db: Database, user_id: int, source: str, target: str) -> None:
+    """Перенос данных пользователя: копирование в новый шард, затем удаление из старого.
+    Первичные ключи уникальны между шардами (чередование последовательностей), поэтому сохраняются
+    """
+    sessions = await db.sessions
+    rows = user_rows(user_id)
+    for model, condition in rows:
+        values = [x[model.__name__].to_dict() for x in (await sessions[source].execute(select(model).where(condition))).mappings().all()]
+        if values:
+            await sessions[target].execute(insert(model).values(values))
+    await sessions[target].commit()
+    for model, condition in reversed(rows):
+        await sessions[source].execute(delete(model).where(condition))
+    await sessions[source].commit()
+
+
+async def rebalance(old_shard_names: list[str], new_shard_names: list[str] = None, dry_run: bool = True) -> dict[int, tuple[str, str]]:
+    """Перенос пользователей, сменивших шард после изменения списка шардов.
+    old_shard_names - шарды до изменения, new_shard_names - после (по умолчанию из настроек)
+    """
+    new_shard_names = new_shard_names or settings.ai_db_settings.shard_names
+    old_map, new_map = ShardMap(old_shard_names), ShardMap(new_shard_names)
+    db = Database(engines_params=settings.all_db)
+    sessions = await db.sessions
+    user_ids = set()
+    stmt = union(select(Chat.user_id), select(File.user_id), select(UserBalance.user_id))
+    for shard_name in old_shard_names:
+        user_ids.update(x for x in (await sessions[shard_name].execute(stmt)).scalars().all() if old_map.get_shard(x) == shard_name)
+    plan = old_map.rebalance_plan(new_map, sorted(user_ids))
+    if not dry_run:
+        for user_id, (source, target) in plan.items():
+            await move_user(db=db, user_id=user_id, source=source, target=target)
+            print(f"user {user_id}: {source} -> {target}")
+    return plan
+
+
+if __name__ == '__main__':
+    # python -m services.ai_service.core.scripts.rebalance <старые шарды через запятую> [--apply]
+    plan = asyncio.run(rebalance(old_shard_names=sys.argv[1].split(","), dry_run="--apply" not in sys.argv))
+    print(f"users to move: {len(plan)}")
@@ -1,7 +1,13 @@
+import asyncio
+from typing import List, Optional, Union
+
 from fastapi import HTTPException
+from sqlalchemy import Executable
 
+from services.ai_service.core.settings import settings
 from shared.db.s3 import S3Database
-from shared.db.sql_database import Database
+from shared.db.sharding import ShardMap
+from shared.db.sql_database import Database, get_unit_of_work
 from shared.dependencies import User
 
 
@@ -25,10 +31,16 @@ class BaseService:
             })
             i += 1
 
+    # чаты, сообщения, файлы и балансы пользователя лежат в одном шарде, выбранном по user_id
+    shard_map = ShardMap(settings.ai_db_settings.shard_names)
+
     def __init__(self, db: Database = None, current_user: User = None, s3: S3Database = None):
         self.__db = db
         self.__current_user = current_user
         self.__s3 = s3
+        if current_user is not None:
+            # чтения с реплик запроса должны видеть прошлые записи пользователя (read-your-writes)
+            get_unit_of_work().consistency_key = current_user.user_id
 
     @property
     def db(self) -> Database:
@@ -47,3 +59,32 @@ class BaseService:
         if not self.__s3:
             raise HTTPException(status_code=404, detail='s3 Database not provided')
         return self.__s3
+
+    def shard_name(self, user_id: Optional[int] = None) -> str:
+        """Шард пользователя, по умолчанию текущего"""
+        if user_id is None:
+            user_id = self.current_user.user_id
+        return self.shard_map.get_shard(user_id)
+
+    def shard_names(self, user_ids: Optional[Union[int, List[int]]] = None) -> List[str]:
+        """Шарды, в которых лежат данные пользователей, None - все шарды"""
+        if user_ids is None:
+            return self.shard_map.shards
+        if isinstance(user_ids, int):
+            user_ids = [user_ids]
+        return list(dict.fromkeys(self.shard_map.get_shard(x) for x in user_ids))
+
+    async def execute_on_shards(self, stmt: Executable, shard_names: List[str], read: bool = True,
+                                params: Optional[dict] = None) -> list:
+        """Выполнение запроса на нескольких шардах, строки результатов объединяются в порядке shard_names.
+        У каждого шарда своя сессия, поэтому запросы к шардам выполняются параллельно
+        """
+
+        async def execute(shard_name: str) -> list:
+            session = await self.db.get_read_session(shard_name) if read else (await self.db.sessions)[shard_name]
+            return (await session.execute(stmt, params)).mappings().all()
+
+        result = []
+        for rows in await asyncio.gather(*[execute(x) for x in shard_names]):
+            result.extend(rows)
+        return result
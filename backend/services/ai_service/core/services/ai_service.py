@@ -1,15 +1,20 @@
 import pprint
+from functools import partial
 from typing import List, Union, Optional
 
 import aiohttp
-from sqlalchemy import insert, select, update
+from sqlalchemy import insert, select, update, case, literal, Text
 
 from services.ai_service.core.db_models import Chat, Message, MessageData, MessageDataXFile, File, FileXCompany, \
-    UserBalance
+    UserBalance, ChatRow
 from services.ai_service.core.schemas.chat_dto import ChatCreateUpdate, MessageDataRead, MessageDataCreateUpdate
 from services.ai_service.core.services import BaseService
 from services.ai_service.core.services.file_service import FileService
+from services.ai_service.core.services.token_service import TokenService
 from services.ai_service.core.settings import settings
+from shared.db.loader import get_loader
+from shared.db.pagination import KeysetPagination
+from shared.db.query_builder import SelectBuilder
 from shared.db.s3 import S3Database
 from shared.db.sql_database import Database
 from shared.dependencies import User
@@ -69,46 +74,61 @@ class AIService(BaseService):
             .values(values_)
             .returning(Chat)
         )
-        result = [x["Chat"] for x in (await (await self.db.sessions)[settings.ai_db_settings.name].execute(stmt)).mappings().all()]
+        result = [x["Chat"] for x in (await (await self.db.sessions)[self.shard_name()].execute(stmt)).mappings().all()]
         return result
 
     async def get_chats(
             self,
             user_ids: Optional[Union[List[int], int]] = None,
             chat_ids: Optional[Union[List[int], int]] = None,
-            existing: Optional[bool] = True
+            existing: Optional[bool] = True,
+            keyset: Optional[KeysetPagination] = None,
+            shard_names: Optional[List[str]] = None
     ) -> List[Chat]:
-        stmt = select(Chat)
-        if user_ids is not None:
-            if isinstance(user_ids, int):
-                user_ids = [user_ids]
-            stmt = stmt.where(Chat.user_id.in_(user_ids))
-        if chat_ids is not None:
-            if isinstance(chat_ids, int):
-                chat_ids = [chat_ids]
-            stmt = stmt.where(Chat.chat_id.in_(chat_ids))
-        if existing is True:
-            stmt = stmt.where(Chat.delete_timestamp == None)
-        elif existing is False:
-            stmt = stmt.where(Chat.delete_timestamp != None)
-        result = await (await self.db.sessions)[settings.ai_db_settings.name].execute(stmt)
-        result = [x["Chat"] for x in (await (await self.db.sessions)[settings.ai_db_settings.name].execute(stmt)).mappings().all()]
+        """shard_names - шарды для поиска, по умолчанию шарды пользователей user_ids (все, если не заданы)"""
+        shard_names = shard_names or self.shard_names(user_ids)
+        query = (
+            SelectBuilder(Chat)
+            .any_(Chat.user_id, user_ids)
+            .any_(Chat.chat_id, chat_ids)
+            .existing(existing)
+            .keyset(keyset)
+        )
+        result = [x["Chat"] for x in await self.execute_on_shards(query.statement, shard_names, params=query.params)]
+        if keyset is not None:
+            result = keyset.paginate(result, merge=len(shard_names) > 1)
         return result
 
-    async def get_chat(self, chat_id: int):
-        result = await self.get_chats(chat_ids=chat_id)
+    async def get_chat(self, chat_id: int) -> ChatRow:
+        # горячий запрос каждого сообщения: выполняется драйвером напрямую без ORM, через DataLoader запроса;
+        # чат другого пользователя в шарде текущего все равно находится и дает 403
+        result = None
+        for shard_name in self.shard_names() if self.current_user.is_admin else [self.shard_name()]:
+            result = await get_loader(("chat", shard_name), partial(self._load_chats, shard_name)).load(chat_id)
+            if result:
+                break
         if not result:
             raise CustomException(status_code=404, detail="Chat not found")
-        result = result[0]
         if self.current_user.is_admin:
             return result
         if self.current_user.user_id != result.user_id:
             raise CustomException(status_code=403, detail="You are not admin and not allowed to access this chat")
         return result
 
-    async def get_chat_history(self, chat_id: int, bypass: bool = False, only_main: bool = False):
+    async def _load_chats(self, shard_name: str, chat_ids: List[int]) -> dict[int, ChatRow]:
+        query = f"""
+            SELECT chat_id, language, user_id, create_timestamp, delete_timestamp
+            FROM {Chat.__tablename__}
+            WHERE chat_id = ANY($1::int[]) AND delete_timestamp IS NULL
+        """
+        return {x.chat_id: x for x in await self.db.fetch(query, shard_name, chat_ids, row_factory=ChatRow, replica=True)}
+
+    async def get_chat_history(self, chat_id: int, bypass: bool = False, only_main: bool = False,
+                               user_id: Optional[int] = None):
+        """user_id - владелец чата (определяет шард) при bypass=True, по умолчанию текущий пользователь"""
         if not bypass:
             current_chat = await self.get_chat(chat_id=chat_id)
+            user_id = current_chat.user_id
 
         main_array = "true" if only_main else "true, false"
         query = f"""
@@ -190,7 +210,11 @@ class AIService(BaseService):
             WHERE chat.chat_id = :chat_id AND chat.delete_timestamp IS NULL
             GROUP BY chat.chat_id, chat.user_id, chat.create_timestamp, chat.language
         """
-        result = await self.db.query(query=query, db_name=settings.ai_db_settings.name, params={"chat_id": chat_id})
+        result = await self.db.query(
+            query=query, db_name=self.shard_name(user_id), params={"chat_id": chat_id}, replica=True
+        )
+        if not result:
+            raise CustomException(status_code=404, detail="Chat not found")
         return result[0]["data"]
 
     # todo: better code structure, wrap in sub-functions
@@ -202,9 +226,16 @@ class AIService(BaseService):
         if model_name not in self.models_settings[company_name]["models"]:
             raise CustomException(status_code=400, detail="Invalid model name")
         current_chat = await self.get_chat(chat_id=chat_id)
-        chat_history = await self.get_chat_history(chat_id=chat_id, bypass=True, only_main=True)
+        chat_history = await self.get_chat_history(chat_id=chat_id, bypass=True, only_main=True, user_id=current_chat.user_id)
         previous_messages = []
         total_files_size = 0
+        # файлы без загрузки в компанию запрашиваются одной выборкой, upload_file_to_company берет их из кэша
+        await file_service.load_files([
+            file["file_id"]
+            for message in chat_history["messages"]
+            for file in message["message_data"][0]["attachments"]
+            if not any(x["company_name"] == company_name for x in file["company_file"])
+        ])
         for message in chat_history["messages"]:
             if company_name == self.gigachat:
                 current_attachments = []
@@ -263,7 +294,9 @@ class AIService(BaseService):
                     json_response = await resp.json()
                     response_message = json_response["choices"][0]["message"]["content"]
                     tokens_consumed = json_response["usage"]["total_tokens"]
-                    stmt = insert(Message).values([
+                    # Сообщения, их текст и списание токенов сохраняются одним запросом
+                    batch = self.db.batch(self.shard_name(current_chat.user_id))
+                    messages = batch.add("messages", insert(Message).values([
                         {
                             "company_name": None,
                             "sender": "user",
@@ -274,23 +307,29 @@ class AIService(BaseService):
                             "sender": "assistant",
                             "chat_id": chat_id,
                         }
-                    ]).returning(Message)
-                    result_message = [x["Message"] for x in (await (await self.db.sessions)[settings.ai_db_settings.name].execute(stmt)).mappings().all()]
-                    stmt = insert(MessageData).values(
-                        [
-                            {
-                                "message_id": result_message[0].message_id,
-                                "text": value.message_data,
-                                "is_main": True
-                            },
-                            {
-                                "message_id": result_message[1].message_id,
-                                "text": response_message,
-                                "is_main": True
-                            }
-                        ]
-                    )
-                    await ((await self.db.sessions)[settings.ai_db_settings.name].execute(stmt))
+                    ]).returning(Message.message_id, Message.sender))
+                    batch.add("message_data", insert(MessageData).from_select(
+                        ["message_id", "text", "is_main"],
+                        select(
+                            messages.c.message_id,
+                            case(
+                                (messages.c.sender == "user", literal(value.message_data, Text)),
+                                else_=literal(response_message, Text)
+                            ),
+                            literal(True)
+                        )
+                    ))
+                    remove_tokens_stmt = TokenService(db=self.db, current_user=self.current_user).remove_n_tokens_stmt(tokens_consumed)
+                    if self.shard_name() == self.shard_name(current_chat.user_id):
+                        batch.add("balance", remove_tokens_stmt)
+                        debited = (await batch.execute())["balance"]
+                    else:
+                        # чат другого пользователя (админ) лежит в другом шарде, баланс списывается отдельно
+                        await batch.execute()
+                        debited = (await (await self.db.sessions)[self.shard_name()].execute(remove_tokens_stmt)).all()
+                    if not debited:
+                        # нет строки баланса: исключение откатывает транзакцию, сообщения без списания не сохраняются
+                        raise CustomException(status_code=402, detail="User balance not found")
 
                 else:
                     raise CustomException(status_code=400, detail=f"{company_name} not working")
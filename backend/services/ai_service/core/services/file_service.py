@@ -1,16 +1,19 @@
 import pprint
-from io import BytesIO
+from datetime import datetime
 from typing import List, Union, Optional, Any
 
 import aiohttp
 from aiohttp import FormData
 from fastapi import UploadFile
-from sqlalchemy import insert, select, update
+from sqlalchemy import insert, update, select
 
 from services.ai_service.core.db_models import File, FileXCompany
 from services.ai_service.core.services import BaseService
 from services.ai_service.core.settings import settings
-from shared.db.s3 import S3Database
+from shared.db.loader import get_loader, clear_loader
+from shared.db.pagination import KeysetPagination
+from shared.db.query_builder import SelectBuilder
+from shared.db.s3 import S3Database, S3Object
 from shared.db.sql_database import Database
 from shared.dependencies import User
 from shared.exceptions.exceptions import CustomException
@@ -23,18 +26,18 @@ class FileService(BaseService):
 
     async def upload_file(self, file: UploadFile, filename: str=None, bucket:str="private") -> File:
         filename = filename or file.filename
-        size = file.size
         result = await self.s3.upload_file(file=file, s3_name=settings.minio_settings.name, filename=filename, bucket=bucket)
         print(result)
         stmt = insert(File).values(
             filename=filename,
             s3_key=result["filename"],
             bucket_name=bucket,
-            file_size=size,
+            file_size=result["size"],
             user_id=self.current_user.user_id,
-            mimetype=result["content_type"]
+            mimetype=result["content_type"],
+            content_hash=result["sha256"]
         ).returning(File)
-        result_2 = await (await self.db.sessions)[settings.ai_db_settings.name].execute(stmt)
+        result_2 = await (await self.db.sessions)[self.shard_name()].execute(stmt)
         result_2 = result_2.mappings().one_or_none()
         if result_2 is None:
             raise CustomException(status_code=500, detail="File not uploaded")
@@ -45,142 +48,175 @@ class FileService(BaseService):
                         user_ids: Optional[Union[int, List[int]]] = None,
                         bucket_names: Optional[Union[str, List[str]]] = None,
                         file_names: Optional[Union[str, List[str]]] = None,
-                        existing: bool = True
+                        existing: bool = True,
+                        keyset: Optional[KeysetPagination] = None
                         ) -> List[File]:
-        stmt = select(File)
-        if file_ids is not None:
-            if isinstance(file_ids, int):
-                file_ids = [file_ids]
-            stmt = stmt.where(
-                File.file_id.in_(file_ids)
-            )
+        query = (
+            SelectBuilder(File)
+            .any_(File.file_id, file_ids)
+            .any_(File.user_id, user_ids)
+            .any_(File.bucket_name, bucket_names)
+            .any_(File.filename, file_names)
+            .existing(existing)
+            .keyset(keyset)
+        )
+        shard_names = self.shard_names(user_ids)
+        result = [x["File"] for x in await self.execute_on_shards(query.statement, shard_names, params=query.params)]
+        if keyset is not None:
+            result = keyset.paginate(result, merge=len(shard_names) > 1)
+        return result
 
-        if user_ids is not None:
-            if isinstance(user_ids, int):
-                user_ids = [user_ids]
-            stmt = stmt.where(
-                File.user_id.in_(user_ids)
-            )
+    async def load_files(self, file_ids: List[int], user_id: Optional[int] = None) -> List[Optional[File]]:
+        """Файлы пользователя (по умолчанию текущего) по id через DataLoader запроса:
+        обращения одного тика объединяются в один запрос, повторные берутся из кэша
+        """
+        user_id = self.current_user.user_id if user_id is None else user_id
 
-        if bucket_names is not None:
-            if isinstance(bucket_names, str):
-                bucket_names = [bucket_names]
-            stmt = stmt.where(
-                File.bucket_name.in_(bucket_names)
-            )
+        async def batch(keys: List[int]) -> dict[int, File]:
+            return {x.file_id: x for x in await self.get_files(file_ids=keys, user_ids=user_id)}
 
-        if file_names is not None:
-            if isinstance(file_names, str):
-                file_names = [file_names]
-            stmt = stmt.where(
-                File.filename.in_(file_names)
-            )
+        return await get_loader(("file", user_id), batch).load_many(file_ids)
 
-        if existing is True:
-            stmt = stmt.where(
-                File.delete_timestamp == None
-            )
-        elif existing is False:
-            stmt = stmt.where(
-                File.delete_timestamp != None
-            )
+    async def load_files_x_company(self, file: File) -> List[FileXCompany]:
+        """Загрузки файла в компании через DataLoader запроса"""
+        user_id = file.user_id
 
-        result = await (await self.db.sessions)[settings.ai_db_settings.name].execute(stmt)
-        result = [x["File"] for x in result.mappings().all()]
-        return result
+        async def batch(keys: List[int]) -> dict[int, List[FileXCompany]]:
+            result = {}
+            for x in await self.get_files_x_company(file_ids=keys, user_ids=user_id):
+                result.setdefault(x.file_id, []).append(x)
+            return result
+
+        return await get_loader(("file_x_company", self.shard_name(user_id)), batch).load(file.file_id) or []
 
     async def get_download_url(self, file_id: int) -> str:
-        result = await self.get_files(file_ids=file_id, user_ids=self.current_user.user_id)
+        result = (await self.load_files([file_id]))[0]
         if not result:
             raise CustomException(status_code=404, detail="File not found")
-        result = result[0]
-        url = (await self.s3.generate_url(keys=[result.s3_key], bucket=result.bucket_name, s3_name=settings.minio_settings.name))["urls"][0]["url"]
+        url = (await self.s3.generate_url(keys=[result.s3_key], bucket=result.bucket_name, s3_name=settings.minio_settings.name, filenames=[result.filename]))["urls"][0]["url"]
         return url
 
+    async def get_download_urls(self, file_ids: List[int]) -> dict[int, Optional[str]]:
+        """Ссылки на скачивание пачки файлов текущего пользователя, None - файл не найден"""
+        files = [x for x in await self.load_files(file_ids) if x is not None]
+        by_bucket: dict[str, List[File]] = {}
+        for file in files:
+            by_bucket.setdefault(file.bucket_name, []).append(file)
+        result: dict[int, Optional[str]] = dict.fromkeys(file_ids)
+        for bucket, bucket_files in by_bucket.items():
+            urls = (await self.s3.generate_url(keys=[x.s3_key for x in bucket_files], bucket=bucket, s3_name=settings.minio_settings.name, filenames=[x.filename for x in bucket_files]))["urls"]
+            for file, url in zip(bucket_files, urls):
+                result[file.file_id] = url["url"]
+        return result
+
+    async def open_file_content(self, file_id: int, byte_range: Optional[str] = None,
+                                if_none_match: Optional[str] = None, if_modified_since: Optional[datetime] = None,
+                                if_range: Optional[str] = None) -> tuple[File, S3Object]:
+        """Файл текущего пользователя и его содержимое для потоковой отдачи"""
+        file = (await self.load_files([file_id]))[0]
+        if not file:
+            raise CustomException(status_code=404, detail="File not found")
+        s3_object = await self.s3.open_file(
+            s3_name=settings.minio_settings.name,
+            filename=file.s3_key,
+            bucket=file.bucket_name,
+            byte_range=byte_range,
+            if_none_match=if_none_match,
+            if_modified_since=if_modified_since,
+            if_range=if_range
+        )
+        return file, s3_object
+
     async def get_files_x_company(
             self,
             file_x_company_ids: Optional[Union[int, List[int]]] = None,
             file_ids: Optional[Union[int, List[int]]] = None,
             company_names: Optional[Union[str, List[str]]] = None,
             file_company_ids: Optional[Union[str, List[str]]] = None,
-            existing: bool = True
+            existing: bool = True,
+            user_ids: Optional[Union[int, List[int]]] = None
     ) -> List[FileXCompany]:
-        stmt = select(FileXCompany)
-        if file_x_company_ids is not None:
-            if isinstance(file_x_company_ids, int):
-                file_x_company_ids = [file_x_company_ids]
-            stmt = stmt.where(
-                FileXCompany.file_x_company_id.in_(file_x_company_ids)
-            )
-        if file_ids is not None:
-            if isinstance(file_ids, int):
-                file_ids = [file_ids]
-            stmt = stmt.where(
-                FileXCompany.file_id.in_(file_ids)
-            )
-        if company_names is not None:
-            if isinstance(company_names, str):
-                company_names = [company_names]
-            stmt = stmt.where(
-                FileXCompany.company_name.in_(company_names)
-            )
-        if file_company_ids is not None:
-            if isinstance(file_company_ids, str):
-                file_company_ids = [file_company_ids]
-            stmt = stmt.where(
-                FileXCompany.file_company_id.in_(file_company_ids)
-            )
-        if existing is True:
-            stmt = stmt.where(
-                FileXCompany.delete_timestamp == None
-            )
-        elif existing is False:
-            stmt = stmt.where(
-                FileXCompany.delete_timestamp != None
-            )
-        result = await (await self.db.sessions)[settings.ai_db_settings.name].execute(stmt)
-        result = [x["FileXCompany"] for x in result.mappings().all()]
+        """user_ids - владельцы файлов, определяют шарды для поиска, None - все шарды"""
+        query = (
+            SelectBuilder(FileXCompany)
+            .any_(FileXCompany.file_x_company_id, file_x_company_ids)
+            .any_(FileXCompany.file_id, file_ids)
+            .any_(FileXCompany.company_name, company_names)
+            .any_(FileXCompany.file_company_id, file_company_ids)
+            .existing(existing)
+        )
+        result = [x["FileXCompany"] for x in await self.execute_on_shards(query.statement, self.shard_names(user_ids), read=False, params=query.params)]
         return result
 
+    async def find_company_file_by_content(self, file: File, company_name: str) -> Optional[tuple[str, str]]:
+        """(file_company_id, id_type) файла с тем же содержимым, уже загруженного в компанию.
+        Поиск во всех шардах параллельно, найденный в шарде владельца файла предпочтительнее
+        """
+        if not file.content_hash:
+            return None
+        stmt = (
+            select(FileXCompany.file_company_id, FileXCompany.id_type)
+            .join(File, File.file_id == FileXCompany.file_id)
+            .where(
+                File.content_hash == file.content_hash,
+                File.delete_timestamp.is_(None),
+                FileXCompany.company_name == company_name,
+                FileXCompany.delete_timestamp.is_(None)
+            )
+            .limit(1)
+        )
+        own_shard = self.shard_name(file.user_id)
+        rows = await self.execute_on_shards(stmt, [own_shard] + [x for x in self.shard_names() if x != own_shard], read=False)
+        if not rows:
+            return None
+        return rows[0]["file_company_id"], rows[0]["id_type"]
+
     async def upload_file_to_company(self, file_id: Union[int, File], company_name: str) -> Any:
         company_name = company_name.strip().lower()
         if company_name not in self.available_companies:
             raise CustomException(status_code=404, detail="Company not found")
         if isinstance(file_id, File):
             file = file_id
-            file_id = file_id.file_id
         else:
-            file = await self.get_files(file_ids=file_id, user_ids=self.current_user.user_id)
+            file = (await self.load_files([file_id]))[0]
         if not file:
             raise CustomException(status_code=404, detail="File not found")
-        file = file[0]
-        if company_name == self.gigachat:
-            formdata = FormData()
-            formdata.add_field(
-                'file',
-                BytesIO(await self.s3.get_file_content(
-                    s3_name=settings.minio_settings.name,
-                    filename=file.s3_key,
-                    bucket=file.bucket_name
-                )),
-                filename=file.filename,
-                content_type=file.mimetype)
-            formdata.add_field("purpose", "general")
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                        url=settings.api_settings.gigachat.file_upload_url,
-                        headers={"Authorization": f"Bearer {settings.api_settings.gigachat.access_token}"},
-                        data=formdata,
-                        ssl=False
-                ) as resp:
-                    if resp.status == 200:
-                        print(resp.status)
-                        print(await resp.json())
-                        resp_json = await resp.json()
-                        file_company_id = resp_json["id"]
-                        id_type = "STRING"
-                    else:
-                        raise CustomException(status_code=500, detail="File not uploaded")
+        for file_x_company in await self.load_files_x_company(file):
+            if file_x_company.company_name == company_name:
+                return file_x_company.file_company_id
+        reused = await self.find_company_file_by_content(file, company_name)
+        if reused is not None:
+            file_company_id, id_type = reused
+        elif company_name == self.gigachat:
+            # файл отправляется потоком с локального диска (дисковый кэш s3), без копии в памяти
+            local_file = await self.s3.open_local_file(
+                s3_name=settings.minio_settings.name,
+                filename=file.s3_key,
+                bucket=file.bucket_name
+            )
+            with local_file:
+                formdata = FormData()
+                formdata.add_field(
+                    'file',
+                    local_file,
+                    filename=file.filename,
+                    content_type=file.mimetype)
+                formdata.add_field("purpose", "general")
+                async with aiohttp.ClientSession() as session:
+                    async with session.post(
+                            url=settings.api_settings.gigachat.file_upload_url,
+                            headers={"Authorization": f"Bearer {settings.api_settings.gigachat.access_token}"},
+                            data=formdata,
+                            ssl=False
+                    ) as resp:
+                        if resp.status == 200:
+                            print(resp.status)
+                            print(await resp.json())
+                            resp_json = await resp.json()
+                            file_company_id = resp_json["id"]
+                            id_type = "STRING"
+                        else:
+                            raise CustomException(status_code=500, detail="File not uploaded")
         else:
             raise CustomException(status_code=404, detail="Company not found")
         stmt = insert(FileXCompany).values(
@@ -189,7 +225,8 @@ class FileService(BaseService):
             file_company_id=file_company_id,
             id_type=id_type
         )
-        await (await self.db.sessions)[settings.ai_db_settings.name].execute(stmt)
+        await (await self.db.sessions)[self.shard_name(file.user_id)].execute(stmt)
+        clear_loader(("file_x_company", self.shard_name(file.user_id)), file.file_id)
         return file_company_id
 
 
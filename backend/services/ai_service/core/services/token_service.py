@@ -1,11 +1,10 @@
 from typing import Optional
 
-from sqlalchemy import select, insert, update
+from sqlalchemy import insert, update
 from sqlalchemy.sql.functions import current_user
 
-from services.ai_service.core.db_models import UserBalance
+from services.ai_service.core.db_models import UserBalance, UserBalanceRow
 from services.ai_service.core.services import BaseService
-from services.ai_service.core.settings import settings
 from shared.db import Database
 from shared.db.s3 import S3Database
 from shared.dependencies import User
@@ -23,18 +22,17 @@ class TokenService(BaseService):
             return 0
         return result.balance
 
-    async def get_user_balance(self) -> Optional[UserBalance]:
-        stmt = (
-            select(UserBalance)
-            .where(
-                (UserBalance.user_id == self.current_user.user_id)
-                & (UserBalance.delete_timestamp == None)
-            )
+    async def get_user_balance(self) -> Optional[UserBalanceRow]:
+        # горячий запрос каждого сообщения, выполняется драйвером напрямую без ORM
+        query = f"""
+            SELECT user_balance_id, user_id, balance
+            FROM {UserBalance.__tablename__}
+            WHERE user_id = $1 AND delete_timestamp IS NULL
+        """
+        return await self.db.fetchrow(
+            query, self.shard_name(), self.current_user.user_id,
+            row_factory=UserBalanceRow
         )
-        result = (await (await self.db.sessions)[settings.ai_db_settings.name].execute(stmt)).mappings().one_or_none()
-        if not result:
-            return None
-        return result["UserBalance"]
 
     async def create_user_balance(self, amount: int) -> UserBalance:
         stmt = (
@@ -45,7 +43,7 @@ class TokenService(BaseService):
             )
             .returning(UserBalance)
         )
-        result = (await (await self.db.sessions)[settings.ai_db_settings.name].execute(stmt)).mappings().one_or_none()
+        result = (await (await self.db.sessions)[self.shard_name()].execute(stmt)).mappings().one_or_none()
         if not result:
             raise CustomException(status_code=500, detail="error while creating user balance")
         return result["UserBalance"]
@@ -65,11 +63,25 @@ class TokenService(BaseService):
             )
             .returning(UserBalance)
         )
-        result = (await (await self.db.sessions)[settings.ai_db_settings.name].execute(stmt)).mappings().one_or_none()
+        result = (await (await self.db.sessions)[self.shard_name()].execute(stmt)).mappings().one_or_none()
         if not result:
             raise CustomException(status_code=500, detail="error while creating user balance")
         return result["UserBalance"]
 
+    def remove_n_tokens_stmt(self, n_tokens: int):
+        """Списание токенов одним UPDATE без предварительного чтения баланса (для выполнения в пачке запросов)"""
+        if n_tokens < 0:
+            raise CustomException(status_code=500, detail="invalid n_tokens")
+        return (
+            update(UserBalance)
+            .where(
+                (UserBalance.user_id == self.current_user.user_id)
+                & (UserBalance.delete_timestamp == None)
+            )
+            .values(balance=UserBalance.balance - n_tokens)
+            .returning(UserBalance.user_balance_id, UserBalance.balance)
+        )
+
     async def remove_n_tokens(self, n_tokens: int):
         if n_tokens < 0:
             raise CustomException(status_code=500, detail="invalid n_tokens")
@@ -85,7 +97,7 @@ class TokenService(BaseService):
             .values(balance=user_balance.balance - n_tokens)
             .returning(UserBalance)
         )
-        result = (await (await self.db.sessions)[settings.ai_db_settings.name].execute(stmt)).mappings().one_or_none()
+        result = (await (await self.db.sessions)[self.shard_name()].execute(stmt)).mappings().one_or_none()
         if not result:
             raise CustomException(status_code=500, detail="error while creating user balance")
         return result["UserBalance"]
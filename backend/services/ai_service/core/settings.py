@@ -17,6 +17,21 @@ class DBSettings(BaseSettings):
     echo: bool = False
     pool_size: int = 50
     max_overflow: int = 20
+    # верхняя граница max_overflow для адаптивного пула, None - размер пула фиксирован
+    pool_max_overflow_limit: tp.Optional[int] = None
+    pool_target_wait: float = 0.05
+    # "transaction" - подключение через PgBouncer в режиме transaction pooling
+    pooler_mode: tp.Optional[str] = None
+    # запросы дольше порога (сек) попадают в буфер медленных запросов профайлера
+    slow_query_threshold: float = 0.5
+    explain_slow_queries: bool = False
+    # сессии и соединения, удерживаемые дольше (сек), печатаются со стеком открытия, None - учет выключен
+    session_leak_age: tp.Optional[float] = None
+
+    replica_urls: tp.List[str] = []
+    replica_max_lag: float = 5
+    # дополнительные базы для шардирования чатов и файлов по user_id, основная база - шард 0
+    shard_urls: tp.List[str] = []
 
     @model_validator(mode='after')
     def set_uri(self) -> tp.Self:
@@ -27,6 +42,45 @@ class DBSettings(BaseSettings):
                 self.url = f"{self.driver}://{self.user}:{self.password}@{self.host}:{self.port_container}/{self.name}"
         return self
 
+    @property
+    def replicas_params(self) -> tp.List[tp.Dict[str, tp.Union[str, int, bool]]]:
+        return [
+            {
+                "name": f"{self.name}_replica_{ind}",
+                "url": url,
+                "echo": self.echo,
+                "pool_size": self.pool_size,
+                "max_overflow": self.max_overflow,
+                "pool_max_overflow_limit": self.pool_max_overflow_limit,
+                "pool_target_wait": self.pool_target_wait,
+                "pooler_mode": self.pooler_mode,
+                "role": "replica",
+                "primary": self.name,
+                "max_lag": self.replica_max_lag
+            }
+            for ind, url in enumerate(self.replica_urls)
+        ]
+
+    @property
+    def shard_names(self) -> tp.List[str]:
+        return [self.name, *[f"{self.name}_shard_{ind}" for ind in range(1, len(self.shard_urls) + 1)]]
+
+    @property
+    def shards_params(self) -> tp.List[tp.Dict[str, tp.Union[str, int, bool]]]:
+        return [
+            {
+                "name": name,
+                "url": url,
+                "echo": self.echo,
+                "pool_size": self.pool_size,
+                "max_overflow": self.max_overflow,
+                "pool_max_overflow_limit": self.pool_max_overflow_limit,
+                "pool_target_wait": self.pool_target_wait,
+                "pooler_mode": self.pooler_mode
+            }
+            for name, url in zip(self.shard_names[1:], self.shard_urls)
+        ]
+
 
 class ServiceSettings(BaseSettings):
     model_config = SettingsConfigDict(env_prefix="AI_SERVICE_", extra="ignore")
@@ -35,6 +89,8 @@ class ServiceSettings(BaseSettings):
     mode: str
     port_container: int
     port_host: int
+    # суммарный лимит соединений всех пулов процесса, None - без ограничения
+    db_connection_budget: tp.Optional[int] = None
 
 
 class AuthServiceSettings(BaseSettings):
@@ -65,6 +121,16 @@ class MinioSetting(BaseSettings):
     port_host_1: int
     port_container_1: int
     url: tp.Optional[str] = None
+    # пул HTTP соединений общего клиента s3
+    max_pool_connections: int = 50
+    keepalive_timeout: float = 60
+    # path (MINIO) | virtual, для локальной подписи ссылок
+    addressing_style: str = "path"
+    presign_cache_size: int = 10000
+    # локальный дисковый кэш объектов, None - выключен
+    disk_cache_dir: tp.Optional[str] = None
+    disk_cache_size: int = 1024 ** 3
+    disk_cache_ttl: float = 60
 
     @model_validator(mode='after')
     def set_uri(self) -> tp.Self:
@@ -112,21 +178,33 @@ class Settings(BaseSettings):
     auth_service_settings: AuthServiceSettings = AuthServiceSettings()
     api_settings: APISettings = APISettings()
     auth_key: tp.Optional[RSAKey] = None
-    all_db: tp.List[tp.Dict[str, tp.Union[str, int, bool]]] = [
+    all_db: tp.List[tp.Dict[str, tp.Any]] = [
         {
             "name": ai_db_settings.name,
             "url": ai_db_settings.url,
             "echo": ai_db_settings.echo,
             "pool_size": ai_db_settings.pool_size,
-            "max_overflow": ai_db_settings.max_overflow
-        }
+            "max_overflow": ai_db_settings.max_overflow,
+            "pool_max_overflow_limit": ai_db_settings.pool_max_overflow_limit,
+            "pool_target_wait": ai_db_settings.pool_target_wait,
+            "pooler_mode": ai_db_settings.pooler_mode
+        },
+        *ai_db_settings.replicas_params,
+        *ai_db_settings.shards_params
     ]
-    all_s3: tp.List[tp.Dict[str, tp.Union[str, int, bool]]] = [
+    all_s3: tp.List[tp.Dict[str, tp.Any]] = [
         {
             "name": minio_settings.name,
             "s3_uri": minio_settings.url,
             "s3_access_key": minio_settings.access_key,
-            "s3_secret_key": minio_settings.secret_key
+            "s3_secret_key": minio_settings.secret_key,
+            "max_pool_connections": minio_settings.max_pool_connections,
+            "keepalive_timeout": minio_settings.keepalive_timeout,
+            "addressing_style": minio_settings.addressing_style,
+            "presign_cache_size": minio_settings.presign_cache_size,
+            "disk_cache_dir": minio_settings.disk_cache_dir,
+            "disk_cache_size": minio_settings.disk_cache_size,
+            "disk_cache_ttl": minio_settings.disk_cache_ttl
         }
     ]
 
@@ -1,4 +1,5 @@
 import json
+from typing import Optional
 
 from fastapi import APIRouter, Depends, Query
 from starlette import status
@@ -9,13 +10,13 @@ from services.ai_service.core.schemas.chat_dto import ChatCreateUpdate, ChatRead
 from services.ai_service.core.services.ai_service import AIService
 from services.ai_service.core.services.token_service import TokenService
 from services.ai_service.core.settings import settings
-from shared.db import Database
+from shared.db import Database, KeysetPagination
 from shared.db.s3 import S3Database
 from shared.dependencies import DbDependency, User, S3Dependency
 from shared.exceptions import CustomException
 
 chat_router = APIRouter(prefix="/chat", tags=["chats"])
-db_dependency = DbDependency(engines_params=settings.all_db)
+db_dependency = DbDependency(engines_params=settings.all_db, read_only_methods=("GET",))
 s3_dependency = S3Dependency(s3_params=settings.all_s3)
 auth_dependency = CustomAuthDependency()
 
@@ -35,13 +36,21 @@ async def create_chat(
 
 @chat_router.get("", response_model=ChatsRead, status_code=status.HTTP_200_OK)
 async def get_current_user_chats(
+        limit: Optional[int] = Query(None, gt=0, le=500),
+        cursor: Optional[str] = Query(None),
         db: Database = Depends(db_dependency),
         current_user: User = Depends(auth_dependency)
 ) -> Response:
-    result = await AIService(db=db, current_user=current_user).get_chats(user_ids=current_user.user_id)
+    keyset = None
+    if limit is not None or cursor is not None:
+        keyset = KeysetPagination(order_by="chat_id", cursor=cursor, limit=limit or 50, descending=True)
+    result = await AIService(db=db, current_user=current_user).get_chats(user_ids=current_user.user_id, keyset=keyset)
     return Response(
         status_code=status.HTTP_200_OK,
-        content=ChatsRead.model_validate({"items": result}, from_attributes=True).model_dump_json(),
+        content=ChatsRead.model_validate(
+            {"items": result, "next_cursor": keyset.next_cursor if keyset else None},
+            from_attributes=True
+        ).model_dump_json(),
         headers={"Content-Type": "application/json"}
     )
 
@@ -80,5 +89,4 @@ async def new_message(
             company_name=company_name, model_name=model_name,
             system_message=body.system_message)
     )
-    await TokenService(db=db, current_user=current_user, s3=s3).remove_n_tokens(data["total_tokens"])
     return data
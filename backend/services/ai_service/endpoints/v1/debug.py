@@ -0,0 +1,27 @@
+import json
+
+from fastapi import APIRouter, Depends
+from starlette import status
+from starlette.responses import Response
+
+from services.ai_service.core.dependencies import CustomAuthDependency
+from shared.db.leaks import leak_detector
+from shared.db.profiler import sql_profiler
+from shared.dependencies import User
+from shared.exceptions import CustomException
+
+debug_router = APIRouter(prefix="/debug", tags=["debug"])
+auth_dependency = CustomAuthDependency()
+
+
+@debug_router.get("/sql", response_model=None, status_code=status.HTTP_200_OK)
+async def get_sql_profile(
+        current_user: User = Depends(auth_dependency)
+) -> Response:
+    if not current_user.is_admin:
+        raise CustomException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+    return Response(
+        status_code=status.HTTP_200_OK,
+        content=json.dumps({**sql_profiler.as_dict(), 'leaks': leak_detector.report()}, default=str),
+        headers={"Content-Type": "application/json"}
+    )
@@ -1,19 +1,23 @@
 import json
+import re
+from email.utils import parsedate_to_datetime
+from typing import List, Optional
 
-from fastapi import APIRouter, UploadFile, Depends, File
+from fastapi import APIRouter, UploadFile, Depends, File, Query, Header
 from starlette import status
-from starlette.responses import Response
+from starlette.responses import Response, StreamingResponse
 
 from services.ai_service.core.dependencies import CustomAuthDependency
 from services.ai_service.core.schemas.file_dto import FileRead
 from services.ai_service.core.services.file_service import FileService
 from services.ai_service.core.settings import settings
 from shared.db import Database
+from shared.db.presign import content_disposition
 from shared.db.s3 import S3Database
 from shared.dependencies import DbDependency, User, S3Dependency
 
 file_router = APIRouter(prefix="/file", tags=["files"])
-db_dependency = DbDependency(engines_params=settings.all_db)
+db_dependency = DbDependency(engines_params=settings.all_db, read_only_methods=("GET",))
 s3_dependency = S3Dependency(s3_params=settings.all_s3)
 auth_dependency = CustomAuthDependency()
 
@@ -51,6 +55,21 @@ async def create_file_post_company(
     )
 
 
+@file_router.get("/urls", response_model=None, status_code=status.HTTP_200_OK)
+async def get_download_urls(
+        file_ids: List[int] = Query(...),
+        current_user: User = Depends(auth_dependency),
+        db: Database=Depends(db_dependency),
+        s3: S3Database=Depends(s3_dependency)
+) -> Response:
+    result = await FileService(s3=s3, current_user=current_user, db=db).get_download_urls(file_ids=file_ids)
+    return Response(
+        status_code=status.HTTP_200_OK,
+        content=json.dumps({"urls": {str(k): v for k, v in result.items()}}),
+        headers={"Content-Type": "application/json"}
+    )
+
+
 @file_router.get("/{file_id}", response_model=None, status_code=status.HTTP_200_OK)
 async def get_download_url(
         file_id: int,
@@ -66,6 +85,45 @@ async def get_download_url(
     )
 
 
+@file_router.get("/{file_id}/content", response_model=None, status_code=status.HTTP_200_OK)
+async def get_file_content(
+        file_id: int,
+        range_header: Optional[str] = Header(None, alias="Range"),
+        if_range: Optional[str] = Header(None),
+        if_none_match: Optional[str] = Header(None),
+        if_modified_since: Optional[str] = Header(None),
+        current_user: User = Depends(auth_dependency),
+        db: Database=Depends(db_dependency),
+        s3: S3Database=Depends(s3_dependency)
+) -> Response:
+    """Потоковая отдача файла через сервис: Range (один диапазон), If-Range (ETag), If-None-Match, If-Modified-Since"""
+    byte_range = range_header.strip() if range_header and re.fullmatch(r"bytes=(\d+-\d*|-\d+)", range_header.strip()) else None
+    if if_range and not if_range.strip().startswith(('"', 'W/')):
+        # If-Range с датой не проверяется - отдается весь файл
+        byte_range = None
+    modified_since = None
+    if if_modified_since:
+        try:
+            modified_since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            pass
+    file, s3_object = await FileService(s3=s3, current_user=current_user, db=db).open_file_content(
+        file_id=file_id,
+        byte_range=byte_range,
+        if_none_match=if_none_match,
+        if_modified_since=modified_since,
+        if_range=if_range if byte_range else None
+    )
+    if s3_object.status in (status.HTTP_304_NOT_MODIFIED, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE):
+        return Response(status_code=s3_object.status, headers=s3_object.headers)
+    headers = {
+        **s3_object.headers,
+        "Content-Type": file.mimetype,
+        "Content-Disposition": content_disposition(file.filename)
+    }
+    return StreamingResponse(s3_object, status_code=s3_object.status, headers=headers, media_type=file.mimetype)
+
+
 @file_router.post("/{file_id}/company/{company_name}", response_model=None, status_code=status.HTTP_200_OK)
 async def upload_to_company(
         file_id: int,
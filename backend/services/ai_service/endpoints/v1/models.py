@@ -12,7 +12,7 @@ from shared.db import Database
 from shared.dependencies import DbDependency, User, S3Dependency
 
 models_router = APIRouter(prefix="/models", tags=["models"])
-db_dependency = DbDependency(engines_params=settings.all_db)
+db_dependency = DbDependency(engines_params=settings.all_db, read_only_methods=("GET",))
 s3_dependency = S3Dependency(s3_params=settings.all_s3)
 auth_dependency = CustomAuthDependency()
 
@@ -11,6 +11,7 @@ from shared.db import Database
 from shared.dependencies import DbDependency, User, S3Dependency
 
 token_router = APIRouter(prefix="/tokens", tags=["tokens"])
+# GET создает баланс пользователя при первом обращении, поэтому READ ONLY не включается
 db_dependency = DbDependency(engines_params=settings.all_db)
 s3_dependency = S3Dependency(s3_params=settings.all_s3)
 auth_dependency = CustomAuthDependency()
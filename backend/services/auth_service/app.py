@@ -1,5 +1,6 @@
 from contextlib import asynccontextmanager
 
+import asyncio
 import sqlalchemy
 from fastapi import FastAPI
 
@@ -9,11 +10,14 @@ from fastapi import FastAPI
 async def lifespan(app: FastAPI):
     from core.scripts import init
     await init()
+    if leak_detector.enabled:
+        asyncio.create_task(leak_detector.watch())
 
     from endpoints import api_router
     app.include_router(api_router)
 
     yield
+    await ConnectionRegistry().shutdown()
 
 app = FastAPI(
     title="Auth Service",
@@ -33,6 +37,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+from shared.db.leaks import leak_detector
+from shared.db.profiler import sql_profiler, profile_requests
+from shared.db.registry import ConnectionRegistry
+from services.auth_service.core.settings import settings as service_settings
+ConnectionRegistry().configure(connection_budget=service_settings.service_settings.db_connection_budget)
+sql_profiler.configure(
+    slow_threshold=service_settings.auth_db_settings.slow_query_threshold,
+    explain=service_settings.auth_db_settings.explain_slow_queries
+)
+leak_detector.configure(max_age=service_settings.auth_db_settings.session_leak_age)
+app.middleware("http")(profile_requests)
+
 from shared.exceptions.exception_handlers import exception_handler, connection_exception_handler, integrity_error_handler
 app.add_exception_handler(sqlalchemy.exc.IntegrityError, integrity_error_handler)
 app.add_exception_handler(sqlalchemy.exc.InterfaceError, connection_exception_handler)
@@ -13,6 +13,7 @@ async def init():
     await db.run_sync_batch(MyBase.metadata.create_all)
     for engine in (await db.get_engines()).values():
         await raw_sql_scripts_init(engine=engine)
+    await db.load_schema()
 
 
 async def raw_sql_scripts_init(engine: AsyncEngine):
@@ -92,29 +92,22 @@ class UserService(BaseService):
             email: Optional[str] = None,
             existing: Optional[bool] = True,
             is_verified: Optional[bool] = True,
-            user_ids: Optional[Union[List[int], int]] = None
+            user_ids: Optional[Union[List[int], int]] = None,
+            keyset: Optional[db_.KeysetPagination] = None
     ) -> List[User]:
-        stmt = select(User)
-        if user_ids:
-            if isinstance(user_ids, int):
-                user_ids = [user_ids]
-            user_ids = tuple(user_ids)
-            stmt = stmt.where(User.user_id.in_(user_ids))
-        if username:
-            stmt = stmt.where(sqlalchemy.func.lower(User.username) == username.lower())
-        if email:
-            stmt = stmt.where(sqlalchemy.func.lower(User.email) == email.lower())
-        if is_verified is True:
-            stmt = stmt.where(User.is_verified == True)
-        elif is_verified is False:
-            stmt = stmt.where(User.is_verified == False)
-        if existing is True:
-            stmt = stmt.where(User.delete_timestamp == None)
-        elif existing is False:
-            stmt = stmt.where(User.delete_timestamp != None)
+        query = (
+            db_.SelectBuilder(User)
+            .any_(User.user_id, user_ids or None)
+            .equals(sqlalchemy.func.lower(User.username), username.lower() if username else None, name="username")
+            .equals(sqlalchemy.func.lower(User.email), email.lower() if email else None, name="email")
+            .flag(User.is_verified, is_verified)
+            .existing(existing)
+            .keyset(keyset)
+        )
 
-        result = await (await self.db.sessions)[settings.auth_db_settings.name].execute(stmt)
-        result = [x["User"] for x in result.mappings().all()]
+        result = await query.all(await self.db.get_read_session(settings.auth_db_settings.name))
+        if keyset is not None:
+            result = keyset.paginate(result)
         return result
 
     async def get_user_by_id(self, user_id: int) -> User:
@@ -20,6 +20,19 @@ class DBSettings(BaseSettings):
     echo: bool = False
     pool_size: int = 50
     max_overflow: int = 20
+    # верхняя граница max_overflow для адаптивного пула, None - размер пула фиксирован
+    pool_max_overflow_limit: tp.Optional[int] = None
+    pool_target_wait: float = 0.05
+    # "transaction" - подключение через PgBouncer в режиме transaction pooling
+    pooler_mode: tp.Optional[str] = None
+    # запросы дольше порога (сек) попадают в буфер медленных запросов профайлера
+    slow_query_threshold: float = 0.5
+    explain_slow_queries: bool = False
+    # сессии и соединения, удерживаемые дольше (сек), печатаются со стеком открытия, None - учет выключен
+    session_leak_age: tp.Optional[float] = None
+
+    replica_urls: tp.List[str] = []
+    replica_max_lag: float = 5
 
     @model_validator(mode='after')
     def set_uri(self) -> tp.Self:
@@ -30,6 +43,25 @@ class DBSettings(BaseSettings):
                 self.url = f"{self.driver}://{self.user}:{self.password}@{self.host}:{self.port_container}/{self.name}"
         return self
 
+    @property
+    def replicas_params(self) -> tp.List[tp.Dict[str, tp.Union[str, int, bool]]]:
+        return [
+            {
+                "name": f"{self.name}_replica_{ind}",
+                "url": url,
+                "echo": self.echo,
+                "pool_size": self.pool_size,
+                "max_overflow": self.max_overflow,
+                "pool_max_overflow_limit": self.pool_max_overflow_limit,
+                "pool_target_wait": self.pool_target_wait,
+                "pooler_mode": self.pooler_mode,
+                "role": "replica",
+                "primary": self.name,
+                "max_lag": self.replica_max_lag
+            }
+            for ind, url in enumerate(self.replica_urls)
+        ]
+
 
 class ServiceSettings(BaseSettings):
     model_config = SettingsConfigDict(env_prefix="AUTH_SERVICE_", extra="ignore")
@@ -38,6 +70,8 @@ class ServiceSettings(BaseSettings):
     mode: str
     port_container: int
     port_host: int
+    # суммарный лимит соединений всех пулов процесса, None - без ограничения
+    db_connection_budget: tp.Optional[int] = None
 
 
 class EmailSettings(BaseSettings):
@@ -91,14 +125,18 @@ class Settings(BaseSettings):
     service_settings: ServiceSettings = ServiceSettings()
     jwt_settings: JwtSettings = JwtSettings()
     email_settings: EmailSettings = EmailSettings()
-    all_db: tp.List[tp.Dict[str, tp.Union[str, int, bool]]] = [
+    all_db: tp.List[tp.Dict[str, tp.Any]] = [
         {
             "name": auth_db_settings.name,
             "url": auth_db_settings.url,
             "echo": auth_db_settings.echo,
             "pool_size": auth_db_settings.pool_size,
-            "max_overflow": auth_db_settings.max_overflow
-        }
+            "max_overflow": auth_db_settings.max_overflow,
+            "pool_max_overflow_limit": auth_db_settings.pool_max_overflow_limit,
+            "pool_target_wait": auth_db_settings.pool_target_wait,
+            "pooler_mode": auth_db_settings.pooler_mode
+        },
+        *auth_db_settings.replicas_params
     ]
 
 
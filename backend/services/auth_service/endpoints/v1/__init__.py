@@ -1,4 +1,5 @@
 from fastapi import APIRouter
+from services.auth_service.endpoints.v1.debug import debug_router
 from services.auth_service.endpoints.v1.jwk import jwk_router
 from services.auth_service.endpoints.v1.user import user_router
 
@@ -6,3 +7,4 @@ v1_router = APIRouter(prefix="/v1")
 
 v1_router.include_router(user_router)
 v1_router.include_router(jwk_router)
+v1_router.include_router(debug_router)
@@ -0,0 +1,28 @@
+import json
+
+from fastapi import APIRouter, Depends
+from starlette import status
+from starlette.responses import Response
+
+from services.auth_service.core.services.jwt_service import JWTService
+from services.auth_service.core.settings import settings
+from shared.db.leaks import leak_detector
+from shared.db.profiler import sql_profiler
+from shared.dependencies import AuthDependency, User
+from shared.exceptions.exceptions import CustomException
+
+debug_router = APIRouter(prefix="/debug", tags=["debug"])
+auth_dependency = AuthDependency(public_jwk=JWTService(jwt_settings=settings.jwt_settings).public_jwk)
+
+
+@debug_router.get("/sql", response_model=None, status_code=status.HTTP_200_OK)
+async def get_sql_profile(
+        current_user: User = Depends(auth_dependency)
+) -> Response:
+    if not current_user.is_admin:
+        raise CustomException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+    return Response(
+        status_code=status.HTTP_200_OK,
+        content=json.dumps({**sql_profiler.as_dict(), 'leaks': leak_detector.report()}, default=str),
+        headers={"Content-Type": "application/json"}
+    )
@@ -14,7 +14,7 @@ from shared.exceptions.exceptions import CustomException
 user_router = APIRouter(prefix="/user", tags=["user"])
 jwt_service = JWTService(jwt_settings=settings.jwt_settings)
 
-db_dependency = DbDependency(engines_params=settings.all_db)
+db_dependency = DbDependency(engines_params=settings.all_db, read_only_methods=("GET",))
 auth_dependency = AuthDependency(public_jwk=jwt_service.public_jwk)
 
 
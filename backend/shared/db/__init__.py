@@ -1 +1,4 @@
-from .sql_database import Database, DBError, DataBaseSession
\ No newline at end of file
+from .sql_database import Database, DBError, DataBaseSession
+from .pagination import KeysetPagination, CursorError
+from .columnar import ColumnBatch, Column
+from .query_builder import SelectBuilder, soft_delete_criteria
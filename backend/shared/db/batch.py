@@ -0,0 +1,59 @@
+import typing as tp
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.sql.selectable import CTE
+
+if tp.TYPE_CHECKING:
+    from .sql_database import Database
+
+
+class StatementBatch:
+    """Накопление нескольких INSERT/UPDATE/DELETE/SELECT и выполнение их одним запросом
+    через data-modifying CTE: один round-trip вместо запроса на каждое выражение.
+
+    Все выражения видят один снимок данных, результаты друг друга доступны только через RETURNING:
+    add() возвращает CTE, на столбцы которого можно ссылаться в следующих выражениях.
+    """
+
+    def __init__(self, db: "Database", db_name: str):
+        self.db = db
+        self.db_name = db_name
+        self.__ctes: dict[str, CTE] = {}
+
+    def add(self, name: str, stmt) -> CTE:
+        if name in self.__ctes:
+            raise ValueError(f'Выражение {name} уже добавлено в пачку')
+        cte = stmt.cte(name)
+        self.__ctes[name] = cte
+        return cte
+
+    def __len__(self) -> int:
+        return len(self.__ctes)
+
+    def build(self) -> sa.Select:
+        columns = []
+        for name, cte in self.__ctes.items():
+            # Выражения без RETURNING выполняются, но в результат не попадают
+            if not len(cte.c):
+                continue
+            columns.append(
+                sa.select(
+                    sa.func.coalesce(sa.func.json_agg(sa.literal_column(name)), sa.text("'[]'::json"), type_=JSON)
+                ).select_from(cte).scalar_subquery().label(name)
+            )
+        stmt = sa.select(*columns) if columns else sa.select(sa.literal(1).label('batch'))
+        for cte in self.__ctes.values():
+            stmt = stmt.add_cte(cte)
+        return stmt
+
+    async def execute(self) -> dict[str, list[dict[str, tp.Any]]]:
+        """Результат - строки RETURNING каждого выражения по имени (значения в виде, приведенном через JSON)"""
+        if not self.__ctes:
+            return {}
+        session = await self.db.get_scoped_session(db_name=self.db_name)
+        await session.begin(write=True)
+        row = (await session.execute(self.build())).mappings().one()
+        names = [name for name, cte in self.__ctes.items() if len(cte.c)]
+        self.__ctes = {}
+        return {name: row[name] for name in names}
@@ -0,0 +1,141 @@
+import array
+import datetime
+import typing as tp
+
+try:
+    import numpy as np
+except ImportError:  # numpy не обязателен, без него колонки собираются в array.array
+    np = None
+
+# типы postgres -> (dtype numpy, typecode array.array, значение на месте NULL)
+_fixed_width_types = {
+    'int2': ('int16', 'h', 0),
+    'int4': ('int32', 'i', 0),
+    'int8': ('int64', 'q', 0),
+    'oid': ('int64', 'q', 0),
+    'float4': ('float32', 'f', 0.0),
+    'float8': ('float64', 'd', 0.0),
+    'bool': ('bool', 'b', False),
+}
+_datetime_types = {'timestamp', 'timestamptz', 'date'}
+
+
+class Column:
+    """Колонка результата в стиле Arrow: буфер значений и маска валидности (None - NULL нет).
+    values - numpy.ndarray, если установлен numpy, иначе array.array для числовых типов и list для остальных
+    """
+
+    def __init__(self, name: str, pg_type: str, values: tp.Any, validity: tp.Optional[tp.Any] = None):
+        self.name = name
+        self.pg_type = pg_type
+        self.values = values
+        self.validity = validity
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @property
+    def null_count(self) -> int:
+        if self.validity is None:
+            return 0
+        return len(self.validity) - int(sum(self.validity))
+
+    def to_list(self) -> list[tp.Any]:
+        values = self.values.tolist() if hasattr(self.values, 'tolist') else list(self.values)
+        if self.validity is None:
+            return values
+        return [x if valid else None for x, valid in zip(values, self.validity)]
+
+
+class ColumnBatch:
+    """Пачка строк результата, разложенная по колонкам"""
+
+    def __init__(self, columns: list[Column]):
+        self.columns = columns
+        self.__by_name = {x.name: x for x in columns}
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def __getitem__(self, name: str) -> tp.Any:
+        return self.__by_name[name].values
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.__by_name
+
+    @property
+    def names(self) -> list[str]:
+        return [x.name for x in self.columns]
+
+    def column(self, name: str) -> Column:
+        return self.__by_name[name]
+
+    def to_dict(self) -> dict[str, list[tp.Any]]:
+        return {x.name: x.to_list() for x in self.columns}
+
+    @classmethod
+    def concat(cls, batches: list["ColumnBatch"]) -> "ColumnBatch":
+        if len(batches) == 1:
+            return batches[0]
+        columns = []
+        for ind, column in enumerate(batches[0].columns):
+            parts = [x.columns[ind] for x in batches]
+            has_nulls = any(x.validity is not None for x in parts)
+            validity = None
+            if np is not None:
+                values = np.concatenate([x.values for x in parts])
+                if has_nulls:
+                    validity = np.concatenate([
+                        x.validity if x.validity is not None else np.ones(len(x), dtype=bool) for x in parts
+                    ])
+            else:
+                values = parts[0].values[:0]
+                for part in parts:
+                    values += part.values
+                if has_nulls:
+                    validity = array.array('b')
+                    for part in parts:
+                        validity += part.validity if part.validity is not None else array.array('b', [1] * len(part))
+            columns.append(Column(name=column.name, pg_type=column.pg_type, values=values, validity=validity))
+        return cls(columns)
+
+
+def _build_column(name: str, pg_type: str, values: tuple) -> Column:
+    has_nulls = None in values
+    if pg_type in _fixed_width_types:
+        dtype, typecode, null_value = _fixed_width_types[pg_type]
+        if has_nulls:
+            validity = [x is not None for x in values]
+            values = [null_value if x is None else x for x in values]
+        else:
+            validity = None
+        if np is not None:
+            return Column(name, pg_type, np.array(values, dtype=dtype),
+                          None if validity is None else np.array(validity, dtype=bool))
+        return Column(name, pg_type, array.array(typecode, values),
+                      None if validity is None else array.array('b', validity))
+
+    if np is not None:
+        if pg_type in _datetime_types and not has_nulls:
+            # timestamptz приводится к UTC, numpy не хранит часовой пояс
+            values = [x.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+                      if isinstance(x, datetime.datetime) and x.tzinfo else x for x in values]
+            return Column(name, pg_type, np.array(values, dtype='datetime64[us]'))
+        array_ = np.empty(len(values), dtype=object)
+        array_[:] = values
+        return Column(name, pg_type, array_,
+                      np.array([x is not None for x in values], dtype=bool) if has_nulls else None)
+    return Column(name, pg_type, list(values),
+                  array.array('b', [x is not None for x in values]) if has_nulls else None)
+
+
+def records_to_batch(records: list[tp.Any], attributes: tp.Sequence[tp.Any]) -> ColumnBatch:
+    """Транспонирование записей asyncpg в колонки, attributes - PreparedStatement.get_attributes()"""
+    if records:
+        columns_values = list(zip(*records))
+    else:
+        columns_values = [() for _ in attributes]
+    return ColumnBatch([
+        _build_column(attribute.name, attribute.type.name, values)
+        for attribute, values in zip(attributes, columns_values)
+    ])
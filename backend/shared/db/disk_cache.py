@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+import typing as tp
+import uuid
+import weakref
+from collections import OrderedDict
+
+_entry_name = re.compile(r'^([0-9a-f]{64})\.([\w\-]+)$')
+
+
+class DiskCache:
+    """Локальный дисковый кэш объектов s3 по (bucket, key, etag): LRU с ограничением по суммарному размеру.
+    Файл пишется во временный и атомарно переименовывается, поэтому читатели (в том числе других процессов
+    с тем же каталогом) никогда не видят недописанный объект, а уже открытый файл переживает вытеснение.
+    Заполнение одного ключа выполняется под блокировкой - параллельные промахи скачивают объект один раз
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1024 ** 3, ttl: float = 60):
+        """ttl - сколько секунд запись отдается без проверки etag в s3"""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        # имя -> [etag, путь, размер, время последней проверки]
+        self.__entries: OrderedDict[str, list] = OrderedDict()
+        self.__locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def _name(bucket: str, key: str) -> str:
+        return hashlib.sha256(f'{bucket}/{key}'.encode()).hexdigest()
+
+    def _load(self) -> None:
+        """Записи, оставшиеся от прошлого запуска, в порядке последнего изменения"""
+        found = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            match = _entry_name.match(entry.name)
+            if match is None:
+                if entry.name.startswith('.tmp-'):
+                    os.unlink(entry.path)
+                continue
+            stat = entry.stat()
+            found.append((stat.st_mtime, match.group(1), f'"{match.group(2)}"', entry.path, stat.st_size))
+        for _, name, etag, path, size in sorted(found):
+            if name in self.__entries:
+                self._drop(name)
+            self.__entries[name] = [etag, path, size, 0.0]
+            self.size += size
+        self._evict()
+
+    def lock(self, bucket: str, key: str) -> asyncio.Lock:
+        name = self._name(bucket, key)
+        lock = self.__locks.get(name)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.__locks[name] = lock
+        return lock
+
+    def lookup(self, bucket: str, key: str) -> tp.Optional[tuple[str, str, bool]]:
+        """(etag, путь, свежая ли запись) или None"""
+        entry = self.__entries.get(self._name(bucket, key))
+        if entry is None:
+            return None
+        return entry[0], entry[1], time.monotonic() - entry[3] < self.ttl
+
+    def touch(self, bucket: str, key: str) -> None:
+        """Попадание: запись становится самой новой и считается проверенной"""
+        name = self._name(bucket, key)
+        entry = self.__entries.get(name)
+        if entry is not None:
+            entry[3] = time.monotonic()
+            self.__entries.move_to_end(name)
+            self.hits += 1
+
+    async def store(self, bucket: str, key: str, etag: str, chunks: tp.AsyncIterable[bytes]) -> str:
+        """Запись объекта в кэш, возвращает путь к файлу"""
+        self.misses += 1
+        name = self._name(bucket, key)
+        path = os.path.join(self.directory, f'{name}.{etag.strip(chr(34))}')
+        tmp_path = os.path.join(self.directory, f'.tmp-{uuid.uuid4().hex}')
+        size = 0
+        out = await asyncio.to_thread(open, tmp_path, 'wb')
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(out.write, chunk)
+                size += len(chunk)
+            await asyncio.to_thread(out.close)
+            await asyncio.to_thread(os.replace, tmp_path, path)
+        except BaseException:
+            out.close()
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        old = self.__entries.get(name)
+        if old is not None and old[1] != path:
+            self.discard(bucket, key)
+        elif old is not None:
+            self.size -= old[2]
+        self.__entries[name] = [etag, path, size, time.monotonic()]
+        self.__entries.move_to_end(name)
+        self.size += size
+        self._evict()
+        return path
+
+    def discard(self, bucket: str, key: str) -> None:
+        self._drop(self._name(bucket, key))
+
+    def _drop(self, name: str) -> None:
+        entry = self.__entries.pop(name, None)
+        if entry is None:
+            return
+        self.size -= entry[2]
+        try:
+            os.unlink(entry[1])
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        # последняя (только что записанная) запись не вытесняется
+        while self.size > self.max_bytes and len(self.__entries) > 1:
+            self._drop(next(iter(self.__entries)))
+            self.evictions += 1
+
+    def as_dict(self) -> dict[str, tp.Any]:
+        total = self.hits + self.misses
+        return {
+            'entries': len(self.__entries),
+            'size': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'evictions': self.evictions
+        }
@@ -0,0 +1,87 @@
+import asyncio
+import time
+import traceback
+import typing as tp
+import weakref
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+class LeakDetector:
+    """Учет открытых сессий и взятых из пула соединений со временем и стеком открытия.
+    report() возвращает удерживаемые дольше max_age, watch() периодически печатает их.
+    Пока max_age не задан, учет выключен и стек не снимается
+    """
+
+    def __init__(self, max_age: tp.Optional[float] = None, stack_limit: int = 15):
+        self.max_age = max_age
+        self.stack_limit = stack_limit
+        self.__sessions: dict[int, tuple[weakref.ref, str, float, list[str]]] = {}
+        self.__connections: dict[int, tuple[str, float, list[str]]] = {}
+        self.__engines: set[int] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_age is not None
+
+    def configure(self, max_age: tp.Optional[float] = None, stack_limit: tp.Optional[int] = None) -> None:
+        self.max_age = max_age
+        if stack_limit is not None:
+            self.stack_limit = stack_limit
+
+    def _stack(self) -> list[str]:
+        return traceback.format_stack(limit=self.stack_limit)[:-2]
+
+    def track_session(self, session: tp.Any, name: str) -> None:
+        if not self.enabled:
+            return
+        self.__sessions[id(session)] = (weakref.ref(session), name, time.monotonic(), self._stack())
+
+    def untrack_session(self, session: tp.Any) -> None:
+        self.__sessions.pop(id(session), None)
+
+    def instrument(self, engine: AsyncEngine, name: str) -> None:
+        sync_engine = engine.sync_engine
+        if id(sync_engine) in self.__engines:
+            return
+        self.__engines.add(id(sync_engine))
+
+        @event.listens_for(sync_engine, 'checkout')
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            if self.enabled:
+                self.__connections[id(connection_record)] = (name, time.monotonic(), self._stack())
+
+        @event.listens_for(sync_engine, 'checkin')
+        def on_checkin(dbapi_connection, connection_record):
+            self.__connections.pop(id(connection_record), None)
+
+    def report(self, max_age: tp.Optional[float] = None) -> dict[str, list[dict[str, tp.Any]]]:
+        max_age = self.max_age if max_age is None else max_age
+        if max_age is None:
+            return {'sessions': [], 'connections': []}
+        now = time.monotonic()
+        sessions = []
+        for key, (ref, name, opened_at, stack) in list(self.__sessions.items()):
+            if ref() is None:
+                self.__sessions.pop(key, None)
+                continue
+            if now - opened_at >= max_age:
+                sessions.append({'db': name, 'age': now - opened_at, 'stack': ''.join(stack)})
+        connections = [
+            {'db': name, 'age': now - opened_at, 'stack': ''.join(stack)}
+            for name, opened_at, stack in list(self.__connections.values())
+            if now - opened_at >= max_age
+        ]
+        return {'sessions': sessions, 'connections': connections}
+
+    async def watch(self, interval: float = 60) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            leaks = self.report()
+            for kind, items in leaks.items():
+                for item in items:
+                    print(f"possible {kind[:-1]} leak in {item['db']}, held {item['age']:.1f}s, opened at:\n{item['stack']}")
+
+
+leak_detector = LeakDetector()
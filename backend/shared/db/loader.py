@@ -0,0 +1,98 @@
+import asyncio
+import typing as tp
+
+from .sql_database import get_unit_of_work
+
+K = tp.TypeVar('K')
+V = tp.TypeVar('V')
+
+
+class DataLoader(tp.Generic[K, V]):
+    """Объединение точечных запросов по ключу в один запрос и запоминание результатов (DataLoader).
+    Ключи, запрошенные в одном тике цикла событий, уходят одной пачкой в batch_fn,
+    повторные запросы того же ключа берутся из кэша до конца запроса.
+    batch_fn(keys) -> {key: value}, отсутствующие ключи дают None
+    """
+
+    def __init__(self, batch_fn: tp.Callable[[list[K]], tp.Awaitable[dict[K, V]]]):
+        self.batch_fn = batch_fn
+        self.__cache: dict[K, asyncio.Future] = {}
+        self.__queue: list[K] = []
+        self.__scheduled = False
+
+    async def load(self, key: K) -> tp.Optional[V]:
+        return (await self.load_many([key]))[0]
+
+    async def load_many(self, keys: tp.Iterable[K]) -> list[tp.Optional[V]]:
+        loop = asyncio.get_running_loop()
+        futures = []
+        dispatcher = False
+        for key in keys:
+            future = self.__cache.get(key)
+            if future is None:
+                future = loop.create_future()
+                self.__cache[key] = future
+                self.__queue.append(key)
+                if not self.__scheduled:
+                    self.__scheduled = True
+                    dispatcher = True
+            futures.append(future)
+
+        if dispatcher:
+            # остальные корутины текущего тика успевают добавить свои ключи в пачку
+            try:
+                await asyncio.sleep(0)
+            except asyncio.CancelledError as e:
+                self._fail(self._take_queue(), e)
+                raise
+            await self._dispatch()
+        return list(await asyncio.gather(*futures))
+
+    def prime(self, key: K, value: V) -> None:
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(value)
+        self.__cache[key] = future
+
+    def clear(self, key: tp.Optional[K] = None) -> None:
+        """Сброс кэша после записи: одного ключа или целиком"""
+        if key is None:
+            self.__cache = {k: v for k, v in self.__cache.items() if not v.done()}
+        elif key in self.__cache and self.__cache[key].done():
+            del self.__cache[key]
+
+    def _take_queue(self) -> list[K]:
+        keys, self.__queue, self.__scheduled = self.__queue, [], False
+        return keys
+
+    def _fail(self, keys: list[K], exception: BaseException) -> None:
+        for key in keys:
+            future = self.__cache.pop(key, None)
+            if future is not None and not future.done():
+                future.set_exception(exception)
+
+    async def _dispatch(self) -> None:
+        keys = self._take_queue()
+        try:
+            values = await self.batch_fn(keys)
+        except Exception as e:
+            self._fail(keys, e)
+            return
+        for key in keys:
+            future = self.__cache.get(key)
+            if future is not None and not future.done():
+                future.set_result(values.get(key))
+
+
+def get_loader(name: tp.Hashable, batch_fn: tp.Callable[[list[K]], tp.Awaitable[dict[K, V]]]) -> DataLoader[K, V]:
+    """DataLoader текущего запроса (хранится в UnitOfWork), name различает загрузчики, например ('file', шард)"""
+    loaders = get_unit_of_work().loaders
+    if name not in loaders:
+        loaders[name] = DataLoader(batch_fn)
+    return loaders[name]
+
+
+def clear_loader(name: tp.Hashable, key: tp.Optional[tp.Any] = None) -> None:
+    """Сброс кэша DataLoader-а текущего запроса после записи"""
+    loader = get_unit_of_work().loaders.get(name)
+    if loader is not None:
+        loader.clear(key)
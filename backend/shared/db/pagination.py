@@ -0,0 +1,138 @@
+import base64
+import datetime
+import json
+import typing as tp
+
+import sqlalchemy as sa
+from sqlalchemy import Select
+
+
+class CursorError(Exception):
+    ...
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and 'dt' in value:
+        return datetime.datetime.fromisoformat(value['dt'])
+    return value
+
+
+def encode_cursor(values: list[tp.Any]) -> str:
+    raw = json.dumps([_encode_value(x) for x in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('UTF-8')).decode('UTF-8')
+
+
+def decode_cursor(cursor: str) -> list[tp.Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('UTF-8')))
+    except Exception:
+        raise CursorError('Некорректный курсор пагинации')
+    if not isinstance(values, list):
+        raise CursorError('Некорректный курсор пагинации')
+    return [_decode_value(x) for x in values]
+
+
+class KeysetPagination:
+    """Keyset (seek) пагинация: вместо OFFSET строки отбираются условием (ключи) > (значения из курсора).
+    После выборки paginate() обрезает лишнюю строку и выставляет next_cursor (None - страниц больше нет)
+    """
+
+    def __init__(self, order_by: tp.Union[str, list[str]], cursor: tp.Optional[str] = None, limit: int = 50,
+                 descending: bool = False):
+        if isinstance(order_by, str):
+            order_by = [order_by]
+        if limit <= 0:
+            raise CursorError('limit должен быть больше 0')
+        self.order_by = order_by
+        self.cursor = cursor
+        self.limit = limit
+        self.descending = descending
+        self.next_cursor: tp.Optional[str] = None
+
+    @property
+    def cursor_values(self) -> tp.Optional[list[tp.Any]]:
+        if not self.cursor:
+            return None
+        values = decode_cursor(self.cursor)
+        if len(values) != len(self.order_by):
+            raise CursorError('Курсор не соответствует ключам сортировки')
+        return values
+
+    def apply_to_query(self, query: str, params: dict) -> tuple[str, dict]:
+        """Оборачивание сырого запроса в подзапрос с условием по курсору"""
+        params = dict(params)
+        columns = [f'keyset_q."{x}"' for x in self.order_by]
+        query = f'SELECT * FROM ({query.strip().rstrip(";")}) AS keyset_q'
+
+        values = self.cursor_values
+        if values is not None:
+            binds = []
+            for ind, value in enumerate(values):
+                params[f'keyset_{ind}'] = value
+                binds.append(f':keyset_{ind}')
+            query += f' WHERE ({", ".join(columns)}) {"<" if self.descending else ">"} ({", ".join(binds)})'
+
+        direction = 'DESC' if self.descending else 'ASC'
+        query += f' ORDER BY {", ".join([f"{x} {direction}" for x in columns])} LIMIT {self.limit + 1}'
+        return query, params
+
+    def select_clauses(self, model) -> tuple[tp.Optional[sa.ColumnElement], list, dict[str, tp.Any]]:
+        """Условие по курсору, сортировка и параметры с постоянной формой запроса:
+        значения курсора и лимит передаются через именованные параметры, а не литералами
+        """
+        columns = [getattr(model, x) for x in self.order_by]
+        params = {'keyset_limit': self.limit + 1}
+        criterion = None
+
+        values = self.cursor_values
+        if values is not None:
+            binds = []
+            for ind, (column, value) in enumerate(zip(columns, values)):
+                params[f'keyset_{ind}'] = value
+                binds.append(sa.bindparam(f'keyset_{ind}', type_=column.type))
+            if len(columns) == 1:
+                left, right = columns[0], binds[0]
+            else:
+                left, right = sa.tuple_(*columns), sa.tuple_(*binds)
+            criterion = left < right if self.descending else left > right
+
+        order_by = [x.desc() if self.descending else x.asc() for x in columns]
+        return criterion, order_by, params
+
+    def apply_to_select(self, stmt: Select, model) -> Select:
+        columns = [getattr(model, x) for x in self.order_by]
+
+        values = self.cursor_values
+        if values is not None:
+            if len(columns) == 1:
+                left, right = columns[0], values[0]
+            else:
+                left, right = sa.tuple_(*columns), sa.tuple_(*values)
+            stmt = stmt.where(left < right if self.descending else left > right)
+
+        return (
+            stmt
+            .order_by(*[x.desc() if self.descending else x.asc() for x in columns])
+            .limit(self.limit + 1)
+        )
+
+    def _row_key(self, row: tp.Any) -> list[tp.Any]:
+        return [row[x] if isinstance(row, dict) else getattr(row, x) for x in self.order_by]
+
+    def paginate(self, rows: tp.Iterable[tp.Any], merge: bool = False) -> list[tp.Any]:
+        """merge=True - rows собраны из нескольких выборок (шардов) и сортируются перед обрезкой"""
+        rows = list(rows)
+        if merge:
+            rows.sort(key=self._row_key, reverse=self.descending)
+        self.next_cursor = None
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            last = rows[-1]
+            self.next_cursor = encode_cursor(self._row_key(last))
+        return rows
@@ -0,0 +1,146 @@
+import time
+import typing as tp
+import uuid
+from collections import deque
+
+import sqlalchemy as sa
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+
+POOLER_MODES = (None, 'session', 'transaction')
+# параметры локального пула, не применимые к NullPool
+_local_pool_params = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_max_overflow_limit', 'pool_target_wait')
+
+
+def unique_statement_name() -> str:
+    return f'__asyncpg_{uuid.uuid4().hex}__'
+
+
+def apply_pooler_mode(engine_params: dict[str, tp.Any], pooler_mode: tp.Optional[str]) -> dict[str, tp.Any]:
+    """Параметры движка для работы за PgBouncer в режиме transaction pooling: соединения не держатся локально
+    (NullPool, пулом занимается PgBouncer), подготовленные выражения не кэшируются между транзакциями,
+    а их имена уникальны, чтобы не пересекаться на общих серверных соединениях
+    """
+    if pooler_mode not in POOLER_MODES:
+        raise ValueError(f'Неизвестный pooler_mode: {pooler_mode}')
+    if pooler_mode != 'transaction':
+        return engine_params
+    params = {k: v for k, v in engine_params.items() if k not in _local_pool_params}
+    params['poolclass'] = NullPool
+    params['connect_args'] = {
+        **params.get('connect_args', {}),
+        'statement_cache_size': 0,
+        'prepared_statement_cache_size': 0,
+        'prepared_statement_name_func': unique_statement_name
+    }
+    return params
+
+
+class PoolStats:
+    """Статистика ожидания соединений из пула"""
+    wait_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+    def __init__(self, window: int = 200):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_histogram = [0] * (len(self.wait_buckets) + 1)
+        self.recent_waits: deque[float] = deque(maxlen=window)
+
+    def observe_wait(self, seconds: float) -> None:
+        self.checkouts += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+        self.recent_waits.append(seconds)
+        for ind, bucket in enumerate(self.wait_buckets):
+            if seconds <= bucket:
+                self.wait_histogram[ind] += 1
+                break
+        else:
+            self.wait_histogram[-1] += 1
+
+    def recent_percentile(self, percentile: float) -> float:
+        if not self.recent_waits:
+            return 0.0
+        waits = sorted(self.recent_waits)
+        return waits[min(len(waits) - 1, int(len(waits) * percentile))]
+
+    def as_dict(self) -> dict[str, tp.Any]:
+        histogram = {f'le_{x}': count for x, count in zip(self.wait_buckets, self.wait_histogram)}
+        histogram['le_inf'] = self.wait_histogram[-1]
+        return {
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'wait_avg': self.wait_total / self.checkouts if self.checkouts else 0.0,
+            'wait_max': self.wait_max,
+            'wait_p95': self.recent_percentile(0.95),
+            'wait_histogram': histogram
+        }
+
+
+class MonitoredPool(AsyncAdaptedQueuePool):
+    """Пул соединений со статистикой ожидания checkout.
+    Если задан max_overflow_limit - max_overflow подстраивается в пределах
+    [исходный max_overflow, max_overflow_limit] по p95 времени ожидания
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+        self.min_overflow = self._max_overflow
+        self.max_overflow_limit: tp.Optional[int] = None
+        self.target_wait = 0.05
+        self.adjust_every = 100
+        self.adjust_step = 5
+
+    def configure_adaptive(self, max_overflow_limit: tp.Optional[int], target_wait: float = 0.05,
+                           adjust_every: int = 100, adjust_step: int = 5) -> None:
+        self.max_overflow_limit = max_overflow_limit
+        self.target_wait = target_wait
+        self.adjust_every = adjust_every
+        self.adjust_step = adjust_step
+
+    def recreate(self) -> "MonitoredPool":
+        pool = super().recreate()
+        pool.stats = self.stats
+        pool.min_overflow = self.min_overflow
+        pool.configure_adaptive(
+            max_overflow_limit=self.max_overflow_limit,
+            target_wait=self.target_wait,
+            adjust_every=self.adjust_every,
+            adjust_step=self.adjust_step
+        )
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except sa.exc.TimeoutError:
+            self.stats.timeouts += 1
+            self._adjust(timeout=True)
+            raise
+        self.stats.observe_wait(time.perf_counter() - start)
+        if self.stats.checkouts % self.adjust_every == 0:
+            self._adjust()
+        return connection
+
+    def _adjust(self, timeout: bool = False) -> None:
+        if self.max_overflow_limit is None:
+            return
+        wait_p95 = self.stats.recent_percentile(0.95)
+        if timeout or wait_p95 > self.target_wait:
+            self._max_overflow = min(self.max_overflow_limit, self._max_overflow + self.adjust_step)
+        elif wait_p95 < self.target_wait / 10:
+            self._max_overflow = max(self.min_overflow, self._max_overflow - self.adjust_step)
+
+    def status_dict(self) -> dict[str, tp.Any]:
+        return {
+            'size': self.size(),
+            'checked_in': self.checkedin(),
+            'checked_out': self.checkedout(),
+            'overflow': self.overflow(),
+            'max_overflow': self._max_overflow,
+            'max_overflow_limit': self.max_overflow_limit,
+            **self.stats.as_dict()
+        }
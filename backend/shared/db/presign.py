@@ -0,0 +1,127 @@
+import datetime
+import hashlib
+import hmac
+import time
+import typing as tp
+from collections import OrderedDict
+from urllib.parse import quote, urlsplit
+
+
+def content_disposition(filename: str) -> str:
+    """Заголовок Content-Disposition для скачивания под исходным именем файла (RFC 6266, имя в UTF-8)"""
+    return f"attachment; filename*=UTF-8''{quote(filename)}"
+
+
+class Presigner:
+    """Локальная подпись GET ссылок s3 (SigV4, query string) без создания клиента и обращений к сети.
+    Ключ подписи выводится из секрета один раз в сутки (он зависит только от даты и региона)
+    """
+
+    def __init__(self, access_key: str, secret_key: str, endpoint: str, region: str = 'us-east-1',
+                 addressing_style: str = 'path'):
+        """addressing_style: path - http://host/bucket/key (MINIO), virtual - http://bucket.host/key"""
+        self.__access_key = access_key
+        self.__secret_key = secret_key
+        self.region = region
+        self.addressing_style = addressing_style
+        endpoint = urlsplit(endpoint)
+        self.scheme = endpoint.scheme or 'https'
+        self.host = endpoint.netloc
+        self.__signing_key: tuple[str, bytes] = ('', b'')
+
+    def _signing_key(self, date: str) -> bytes:
+        if self.__signing_key[0] != date:
+            key = ('AWS4' + self.__secret_key).encode()
+            for part in (date, self.region, 's3', 'aws4_request'):
+                key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+            self.__signing_key = (date, key)
+        return self.__signing_key[1]
+
+    def url(self, bucket: str, key: str, expires_in: int = 3600, now: tp.Optional[datetime.datetime] = None,
+            params: tp.Optional[dict[str, str]] = None) -> str:
+        """params - дополнительные подписываемые параметры запроса (например response-content-disposition)"""
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        date = amz_date[:8]
+        if self.addressing_style == 'virtual':
+            host = f'{bucket}.{self.host}'
+            path = '/' + quote(key, safe='/~')
+        else:
+            host = self.host
+            path = f'/{quote(bucket, safe="~")}/' + quote(key, safe='/~')
+        scope = f'{date}/{self.region}/s3/aws4_request'
+        query = '&'.join(
+            f'{quote(name, safe="-_.~")}={quote(value, safe="-_.~")}'
+            for name, value in sorted({
+                'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+                'X-Amz-Credential': f'{self.__access_key}/{scope}',
+                'X-Amz-Date': amz_date,
+                'X-Amz-Expires': str(expires_in),
+                'X-Amz-SignedHeaders': 'host',
+                **(params or {})
+            }.items())
+        )
+        canonical_request = f'GET\n{path}\n{query}\nhost:{host}\n\nhost\nUNSIGNED-PAYLOAD'
+        string_to_sign = (
+            f'AWS4-HMAC-SHA256\n{amz_date}\n{scope}\n'
+            f'{hashlib.sha256(canonical_request.encode()).hexdigest()}'
+        )
+        signature = hmac.new(self._signing_key(date), string_to_sign.encode(), hashlib.sha256).hexdigest()
+        return f'{self.scheme}://{host}{path}?{query}&X-Amz-Signature={signature}'
+
+
+class PresignedUrlCache:
+    """Кэш выданных ссылок по (bucket, key, expires_in, filename): LRU, ссылка переиспользуется, пока до ее
+    истечения (момент сохраняется вместе со ссылкой) остается больше refresh_before секунд
+    (для коротких ссылок - больше половины срока)
+    """
+
+    def __init__(self, presigner: Presigner, max_size: int = 10000, refresh_before: float = 300):
+        self.presigner = presigner
+        self.max_size = max_size
+        self.refresh_before = refresh_before
+        self.hits = 0
+        self.misses = 0
+        # ключ -> (момент истечения ссылки, ссылка)
+        self.__entries: OrderedDict[tuple[str, str, int, tp.Optional[str]], tuple[float, str]] = OrderedDict()
+
+    def url(self, bucket: str, key: str, expires_in: int = 3600, filename: tp.Optional[str] = None) -> str:
+        """filename - имя, под которым браузер сохранит файл (response-content-disposition)"""
+        now = time.time()
+        cache_key = (bucket, key, expires_in, filename)
+        entry = self.__entries.get(cache_key)
+        if entry is not None and entry[0] - now > min(self.refresh_before, expires_in / 2):
+            self.__entries.move_to_end(cache_key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        url = self.presigner.url(
+            bucket=bucket, key=key, expires_in=expires_in,
+            now=datetime.datetime.fromtimestamp(now, datetime.timezone.utc),
+            params={'response-content-disposition': content_disposition(filename)} if filename else None
+        )
+        # X-Amz-Date подписывается с точностью до секунды
+        self.__entries[cache_key] = (int(now) + expires_in, url)
+        self.__entries.move_to_end(cache_key)
+        while len(self.__entries) > self.max_size:
+            self.__entries.popitem(last=False)
+        return url
+
+    def urls(self, bucket: str, keys: tp.Iterable[str], expires_in: int = 3600,
+             filenames: tp.Optional[tp.Iterable[tp.Optional[str]]] = None) -> list[str]:
+        keys = list(keys)
+        filenames = [None] * len(keys) if filenames is None else list(filenames)
+        return [
+            self.url(bucket=bucket, key=key, expires_in=expires_in, filename=filename)
+            for key, filename in zip(keys, filenames)
+        ]
+
+    def as_dict(self) -> dict[str, tp.Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self.__entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
@@ -0,0 +1,180 @@
+import asyncio
+import datetime
+import re
+import time
+import typing as tp
+from collections import Counter, deque
+from contextvars import ContextVar
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .pool import MonitoredPool
+
+_placeholders = re.compile(r'\$\d+')
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_lists = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_spaces = re.compile(r'\s+')
+
+
+def normalize_statement(statement: str) -> str:
+    """Форма запроса без значений: параметры, литералы и списки IN (...) сворачиваются в ?"""
+    statement = _placeholders.sub('?', statement)
+    statement = _literals.sub('?', statement)
+    statement = _lists.sub('(?)', statement)
+    return _spaces.sub(' ', statement).strip()
+
+
+class RequestProfile:
+    """Запросы к БД, выполненные в рамках одного HTTP запроса"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.statements: list[tuple[str, float]] = []
+        self.shapes: Counter[str] = Counter()
+
+    def add(self, statement: str, duration: float) -> None:
+        self.statements.append((statement, duration))
+        self.shapes[normalize_statement(statement)] += 1
+
+    @property
+    def total_time(self) -> float:
+        return sum(x[1] for x in self.statements)
+
+    def repeated(self, threshold: int) -> dict[str, int]:
+        return {k: v for k, v in self.shapes.items() if v >= threshold}
+
+    def as_dict(self, repeat_threshold: int) -> dict[str, tp.Any]:
+        return {
+            'request': self.name,
+            'statements_count': len(self.statements),
+            'total_time': self.total_time,
+            'statements': [{'statement': x, 'duration': d} for x, d in self.statements],
+            'repeated': self.repeated(repeat_threshold)
+        }
+
+
+current_profile: ContextVar[tp.Optional[RequestProfile]] = ContextVar('current_profile', default=None)
+
+
+class SQLProfiler:
+    """Сбор статистики запросов через события движка SQLAlchemy.
+    Медленные SELECT при explain=True дополнительно разбираются EXPLAIN (ANALYZE, BUFFERS) на отдельном соединении
+    """
+
+    def __init__(self, slow_threshold: float = 0.5, explain: bool = False, repeat_threshold: int = 3,
+                 buffer_size: int = 100):
+        self.slow_threshold = slow_threshold
+        self.explain = explain
+        self.repeat_threshold = repeat_threshold
+        self.slow_queries: deque[dict[str, tp.Any]] = deque(maxlen=buffer_size)
+        self.requests: deque[dict[str, tp.Any]] = deque(maxlen=buffer_size)
+        self.engines: dict[str, list[AsyncEngine]] = {}
+        # попадания в кэш компиляции SQLAlchemy: cache_hit, cache_miss, no_cache_key, ...
+        self.compiled_cache: Counter[str] = Counter()
+        self.__async_engines: dict[int, AsyncEngine] = {}
+        self.__tasks: set[asyncio.Task] = set()
+
+    def configure(self, slow_threshold: tp.Optional[float] = None, explain: tp.Optional[bool] = None,
+                  repeat_threshold: tp.Optional[int] = None) -> None:
+        if slow_threshold is not None:
+            self.slow_threshold = slow_threshold
+        if explain is not None:
+            self.explain = explain
+        if repeat_threshold is not None:
+            self.repeat_threshold = repeat_threshold
+
+    def instrument(self, engine: AsyncEngine, name: str) -> None:
+        sync_engine = engine.sync_engine
+        if event.contains(sync_engine, 'before_cursor_execute', self._before_cursor_execute):
+            return
+        event.listen(sync_engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(sync_engine, 'after_cursor_execute', self._after_cursor_execute)
+        self.__async_engines[id(sync_engine)] = engine
+        self.engines.setdefault(name, []).append(engine)
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['query_start_time'].pop()
+        if statement.lstrip()[:7].upper() == 'EXPLAIN':
+            return
+        if context is not None:
+            self.compiled_cache[context.cache_hit.name.lower()] += 1
+        profile = current_profile.get()
+        if profile is not None:
+            profile.add(statement, duration)
+        if duration >= self.slow_threshold:
+            self._record_slow(conn.engine, statement, parameters, duration, profile)
+
+    def _record_slow(self, sync_engine, statement, parameters, duration: float,
+                     profile: tp.Optional[RequestProfile]) -> None:
+        entry = {
+            'statement': statement,
+            'duration': duration,
+            'timestamp': datetime.datetime.now(),
+            'request': profile.name if profile else None,
+            'plan': None
+        }
+        self.slow_queries.append(entry)
+        # EXPLAIN ANALYZE выполняет запрос повторно, поэтому разбираются только чтения
+        if not self.explain or statement.lstrip()[:6].upper() != 'SELECT':
+            return
+        engine = self.__async_engines.get(id(sync_engine))
+        if engine is None:
+            return
+        task = asyncio.get_running_loop().create_task(self._explain(engine, statement, parameters, entry))
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    @staticmethod
+    async def _explain(engine: AsyncEngine, statement: str, parameters, entry: dict[str, tp.Any]) -> None:
+        try:
+            async with engine.connect() as conn:
+                result = await conn.exec_driver_sql(
+                    f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}',
+                    parameters
+                )
+                entry['plan'] = result.scalar()
+                await conn.rollback()
+        except Exception as e:
+            entry['plan'] = f'EXPLAIN error: {e}'
+
+    def finish(self, profile: RequestProfile) -> None:
+        self.requests.append(profile.as_dict(self.repeat_threshold))
+        repeated = profile.repeated(self.repeat_threshold)
+        if repeated:
+            print(f"possible N+1 in {profile.name}: {repeated}")
+
+    @property
+    def compiled_cache_hit_rate(self) -> float:
+        total = self.compiled_cache['cache_hit'] + self.compiled_cache['cache_miss']
+        return self.compiled_cache['cache_hit'] / total if total else 0.0
+
+    def as_dict(self) -> dict[str, tp.Any]:
+        return {
+            'compiled_cache': {**self.compiled_cache, 'hit_rate': self.compiled_cache_hit_rate},
+            'slow_queries': list(self.slow_queries),
+            'requests': list(self.requests),
+            'pools': {
+                name: [x.pool.status_dict() if isinstance(x.pool, MonitoredPool) else x.pool.status() for x in engines]
+                for name, engines in self.engines.items()
+            }
+        }
+
+
+sql_profiler = SQLProfiler()
+
+
+async def profile_requests(request: Request, call_next):
+    """HTTP middleware: собирает профиль запросов к БД и отдает количество и время в заголовках"""
+    profile = RequestProfile(name=f'{request.method} {request.url.path}')
+    current_profile.set(profile)
+    response = await call_next(request)
+    sql_profiler.finish(profile)
+    response.headers['X-DB-Statements'] = str(len(profile.statements))
+    response.headers['X-DB-Time'] = f'{profile.total_time:.4f}'
+    return response
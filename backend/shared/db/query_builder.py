@@ -0,0 +1,101 @@
+import typing as tp
+
+import sqlalchemy as sa
+from sqlalchemy import lambda_stmt, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.sql.lambdas import StatementLambdaElement
+
+from .pagination import KeysetPagination
+
+
+def soft_delete_criteria(model, existing: tp.Optional[bool] = True) -> tp.Optional[sa.ColumnElement]:
+    """Фильтр по delete_timestamp: True - живые строки, False - удаленные, None - все"""
+    if existing is True:
+        return model.delete_timestamp.is_(None)
+    if existing is False:
+        return model.delete_timestamp.is_not(None)
+    return None
+
+
+def _where(criterion):
+    return lambda s: s.where(criterion)
+
+
+def _order_by(clause):
+    return lambda s: s.order_by(clause)
+
+
+def _limit(limit_param):
+    return lambda s: s.limit(limit_param)
+
+
+class SelectBuilder:
+    """Построение select(model) с постоянной формой запроса для кэша компиляции SQLAlchemy.
+    Запрос собирается из lambda_stmt, все значения фильтров передаются именованными параметрами:
+    списки - одним массивом в = ANY(:param), поэтому длина списка не меняет текст запроса.
+    Разные наборы фильтров дают разные записи в кэше, но их число ограничено комбинациями фильтров
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.__stmt: StatementLambdaElement = lambda_stmt(lambda: select(model))
+        self.__params: dict[str, tp.Any] = {}
+
+    @property
+    def statement(self) -> StatementLambdaElement:
+        return self.__stmt
+
+    @property
+    def params(self) -> dict[str, tp.Any]:
+        return self.__params
+
+    def where(self, criterion: sa.ColumnElement, **params) -> "SelectBuilder":
+        """criterion не должен содержать литералов, значения передаются через sa.bindparam и params"""
+        self.__stmt += _where(criterion)
+        self.__params.update(params)
+        return self
+
+    def any_(self, column, values: tp.Optional[tp.Union[tp.Any, tp.Iterable[tp.Any]]],
+             name: tp.Optional[str] = None) -> "SelectBuilder":
+        """column = ANY(:name), одиночное значение оборачивается в список, None - фильтр не применяется"""
+        if values is None:
+            return self
+        if isinstance(values, (str, bytes)) or not isinstance(values, tp.Iterable):
+            values = [values]
+        name = name or f'{column.key}_any'
+        return self.where(column == sa.any_(sa.bindparam(name, type_=ARRAY(column.type))), **{name: list(values)})
+
+    def equals(self, expression, value: tp.Any, name: str) -> "SelectBuilder":
+        if value is None:
+            return self
+        return self.where(expression == sa.bindparam(name, type_=expression.type), **{name: value})
+
+    def flag(self, column, value: tp.Optional[bool]) -> "SelectBuilder":
+        if value is True:
+            return self.where(column.is_(sa.true()))
+        if value is False:
+            return self.where(column.is_(sa.false()))
+        return self
+
+    def existing(self, existing: tp.Optional[bool] = True) -> "SelectBuilder":
+        criterion = soft_delete_criteria(self.model, existing)
+        if criterion is None:
+            return self
+        return self.where(criterion)
+
+    def keyset(self, keyset: tp.Optional[KeysetPagination]) -> "SelectBuilder":
+        if keyset is None:
+            return self
+        criterion, order_by, params = keyset.select_clauses(self.model)
+        if criterion is not None:
+            self.__stmt += _where(criterion)
+        for clause in order_by:
+            self.__stmt += _order_by(clause)
+        self.__stmt += _limit(sa.bindparam('keyset_limit', type_=sa.Integer))
+        self.__params.update(params)
+        return self
+
+    async def all(self, session) -> list:
+        """Выполнение на DataBaseSession, возвращает объекты модели"""
+        result = await session.execute(self.__stmt, self.__params)
+        return list(result.scalars().all())
@@ -0,0 +1,57 @@
+import typing as tp
+
+from shared.utils import Singleton
+
+
+class ConnectionBudgetError(Exception):
+    ...
+
+
+class ConnectionRegistry(metaclass=Singleton):
+    """Процессный реестр подключений: один DataBaseSession (движок и пул) на базу/DSN
+    и одна S3Session на endpoint/ключ, независимо от количества роутеров и зависимостей.
+    connection_budget - суммарный лимит соединений всех пулов процесса
+    """
+
+    def __init__(self):
+        self.connection_budget: tp.Optional[int] = None
+        self.__allocated = 0
+        self.__objects: dict[tuple, tp.Any] = {}
+
+    def configure(self, connection_budget: tp.Optional[int] = None) -> None:
+        self.connection_budget = connection_budget
+
+    @property
+    def allocated_connections(self) -> int:
+        return self.__allocated
+
+    def get_or_create(self, key: tuple, factory: tp.Callable[[], tp.Any]) -> tp.Any:
+        if key not in self.__objects:
+            self.__objects[key] = factory()
+        return self.__objects[key]
+
+    async def shutdown(self) -> None:
+        """Закрытие клиентов и пулов всех зарегистрированных подключений (при остановке приложения)"""
+        objects = list(self.__objects.values())
+        self.__objects.clear()
+        self.__allocated = 0
+        for obj in objects:
+            if hasattr(obj, 'shutdown'):
+                await obj.shutdown()
+
+    def limit_pool(self, engine_params: dict[str, tp.Any]) -> dict[str, tp.Any]:
+        """Урезание pool_size/max_overflow под оставшийся бюджет соединений"""
+        if self.connection_budget is None or 'poolclass' in engine_params or engine_params.get('pooler_mode') == 'transaction':
+            return engine_params
+        remaining = self.connection_budget - self.__allocated
+        if remaining <= 0:
+            raise ConnectionBudgetError(f'Бюджет соединений ({self.connection_budget}) исчерпан')
+        params = dict(engine_params)
+        params['pool_size'] = min(params.get('pool_size', 5), remaining)
+        params['max_overflow'] = min(params.get('max_overflow', 10), remaining - params['pool_size'])
+        overflow = params['max_overflow']
+        if params.get('pool_max_overflow_limit') is not None:
+            params['pool_max_overflow_limit'] = min(params['pool_max_overflow_limit'], remaining - params['pool_size'])
+            overflow = max(overflow, params['pool_max_overflow_limit'])
+        self.__allocated += params['pool_size'] + overflow
+        return params
@@ -1,29 +1,58 @@
+import asyncio
 import base64
 import copy
+import datetime
+import hashlib
 import io
 import mimetypes
-import os
+import re
 import typing as tp
 import uuid
+from email.utils import format_datetime
+from tempfile import SpooledTemporaryFile
 
 import aioboto3
+from aiobotocore.config import AioConfig
 from botocore.exceptions import ClientError
 from fastapi import UploadFile
 
+from .disk_cache import DiskCache
+from .presign import Presigner, PresignedUrlCache
+from .registry import ConnectionRegistry
+
+
+_content_key = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{64}$')
+
 
 class S3_error(Exception):
     ...
 
 class S3Session:
-    """Класс для хранения и управления сессией подключения к s3
+    """Класс для хранения и управления сессией подключения к s3.
+    Клиент (и его пул HTTP соединений) создается один раз и переиспользуется всеми операциями,
+    закрывается через shutdown() при остановке приложения
     """
-    def __init__(self, s3_access_key, s3_secret_key, s3_uri):
+    def __init__(self, s3_access_key, s3_secret_key, s3_uri, max_pool_connections: int = 50,
+                 keepalive_timeout: float = 60, addressing_style: str = 'path', presign_cache_size: int = 10000,
+                 disk_cache_dir: tp.Optional[str] = None, disk_cache_size: int = 1024 ** 3, disk_cache_ttl: float = 60):
         self.__s3_access_key = s3_access_key
         self.__s3_secret_key = s3_secret_key
         self.__s3_uri = s3_uri
+        self.max_pool_connections = max_pool_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.addressing_style = addressing_style
+        self.presign_cache_size = presign_cache_size
+        self.__presigned_urls = None
+        # дисковый кэш объектов, None - выключен
+        self.disk_cache = DiskCache(
+            directory=disk_cache_dir, max_bytes=disk_cache_size, ttl=disk_cache_ttl
+        ) if disk_cache_dir else None
 
         ## Создание сессии, отложено до востребования
         self.__session = None
+        self.__client = None
+        self.__client_context = None
+        self.__client_lock = asyncio.Lock()
 
     @property
     def uri(self):
@@ -40,19 +69,105 @@ class S3Session:
         return self.__session
 
     @property
-    def client(self):
-        client = self.session.client(
-                "s3",
-                endpoint_url=self.__s3_uri,
-                use_ssl=True,
-                verify=False
+    def presigned_urls(self) -> PresignedUrlCache:
+        """Подпись ссылок локально по ключам доступа, без клиента, с кэшем выданных ссылок"""
+        if self.__presigned_urls is None:
+            self.__presigned_urls = PresignedUrlCache(
+                presigner=Presigner(
+                    access_key=self.__s3_access_key,
+                    secret_key=self.__s3_secret_key,
+                    endpoint=self.__s3_uri,
+                    addressing_style=self.addressing_style
+                ),
+                max_size=self.presign_cache_size
             )
-        return client
+        return self.__presigned_urls
+
+    async def get_client(self):
+        """Общий клиент s3 с пулом keep-alive соединений"""
+        if self.__client is None:
+            async with self.__client_lock:
+                if self.__client is None:
+                    client_context = self.session.client(
+                        "s3",
+                        endpoint_url=self.__s3_uri,
+                        use_ssl=True,
+                        verify=False,
+                        config=AioConfig(
+                            max_pool_connections=self.max_pool_connections,
+                            tcp_keepalive=True,
+                            connector_args={'keepalive_timeout': self.keepalive_timeout}
+                        )
+                    )
+                    self.__client = await client_context.__aenter__()
+                    self.__client_context = client_context
+        return self.__client
+
+    async def shutdown(self) -> None:
+        async with self.__client_lock:
+            if self.__client_context is not None:
+                await self.__client_context.__aexit__(None, None, None)
+            self.__client = None
+            self.__client_context = None
+
+
+class S3Object:
+    """Открытый на чтение объект s3: метаданные ответа и тело, которое отдается частями.
+    status: 200 - весь объект, 206 - диапазон, 304 - не изменился, 416 - диапазон вне объекта (тела нет)
+    """
+
+    def __init__(self, status: int, headers: dict[str, str], body=None, chunk_size: int = 64 * 1024):
+        self.status = status
+        self.headers = headers
+        self.chunk_size = chunk_size
+        self.__body = body
+
+    @classmethod
+    def from_response(cls, response: dict, chunk_size: int = 64 * 1024) -> 'S3Object':
+        headers = {'Accept-Ranges': 'bytes', 'Content-Length': str(response['ContentLength'])}
+        if response.get('ContentRange'):
+            headers['Content-Range'] = response['ContentRange']
+        if response.get('ETag'):
+            headers['ETag'] = response['ETag']
+        if response.get('LastModified'):
+            # botocore возвращает время с tzutc, а format_datetime(usegmt=True) требует datetime.timezone.utc
+            headers['Last-Modified'] = format_datetime(
+                response['LastModified'].astimezone(datetime.timezone.utc), usegmt=True
+            )
+        if response.get('ContentType'):
+            headers['Content-Type'] = response['ContentType']
+        return cls(
+            status=206 if response.get('ContentRange') else 200,
+            headers=headers,
+            body=response['Body'],
+            chunk_size=chunk_size
+        )
+
+    @property
+    def content_length(self) -> int:
+        return int(self.headers.get('Content-Length', 0))
+
+    async def __aiter__(self) -> tp.AsyncIterator[bytes]:
+        if self.__body is None:
+            return
+        body, self.__body = self.__body, None
+        async with body:
+            async for chunk in body.iter_chunks(self.chunk_size):
+                yield chunk
+
+    async def close(self) -> None:
+        """Освобождение соединения, если тело не было дочитано"""
+        if self.__body is not None:
+            body, self.__body = self.__body, None
+            body.close()
 
 
 class S3Database:
     """Класс для кэширования сессий aioboto
     """
+    # размер части multipart upload (минимум s3 - 5 МБ) и число частей, загружаемых параллельно
+    multipart_chunk_size = 8 * 1024 * 1024
+    multipart_concurrency = 4
 
     def __init__(self, s3_params: list[dict[str, tp.Union[int, str, bool]]]):
         self.__sessions: dict[str, tp.Optional[S3Session]] = {}
@@ -66,11 +181,23 @@ class S3Database:
     @property
     def sessions(self) -> dict[str, tp.Optional[S3Session]]:
         if not self.__sessions:
+            # Сессии общие для всех экземпляров S3Database в процессе
+            registry = ConnectionRegistry()
             for s3_name, s3_param in self.__s3_params.items():
-                self.__sessions[s3_name] = S3Session(
-                    s3_access_key=s3_param["s3_access_key"],
-                    s3_secret_key=s3_param["s3_secret_key"],
-                    s3_uri=s3_param["s3_uri"]
+                self.__sessions[s3_name] = registry.get_or_create(
+                    key=('s3', s3_param["s3_uri"], s3_param["s3_access_key"]),
+                    factory=lambda s3_param_=s3_param: S3Session(
+                        s3_access_key=s3_param_["s3_access_key"],
+                        s3_secret_key=s3_param_["s3_secret_key"],
+                        s3_uri=s3_param_["s3_uri"],
+                        max_pool_connections=s3_param_.get("max_pool_connections", 50),
+                        keepalive_timeout=s3_param_.get("keepalive_timeout", 60),
+                        addressing_style=s3_param_.get("addressing_style", "path"),
+                        presign_cache_size=s3_param_.get("presign_cache_size", 10000),
+                        disk_cache_dir=s3_param_.get("disk_cache_dir"),
+                        disk_cache_size=s3_param_.get("disk_cache_size", 1024 ** 3),
+                        disk_cache_ttl=s3_param_.get("disk_cache_ttl", 60)
+                    )
                 )
         return self.__sessions
 
@@ -81,75 +208,143 @@ class S3Database:
         except KeyError:
             raise S3_error(f"Базы данных с name = {s3_name} не найдено")
 
-    async def _generate_unique_key(self, filename: str, bucket: str, s3_name: str) -> str:
-        base_name, extension = os.path.splitext(filename)
-        key = filename
-        counter = 1
-        while True:
-            try:
-                async with self.get_session(s3_name=s3_name).client as s3_client:
-                    await s3_client.head_object(Bucket=bucket, Key=key)
-                    key = f"{base_name}_{counter}{extension}"
-                    counter += 1
-            except ClientError as e:
-                if e.response['Error']['Code'] == '404':
-                    break
-                else:
-                    raise
-        return key
+    @staticmethod
+    def content_key(sha256: str) -> str:
+        """Ключ объекта по содержимому: одинаковые файлы хранятся один раз"""
+        return f"{sha256[:2]}/{sha256}"
+
+    async def _object_exists(self, s3_client, bucket: str, key: str) -> bool:
+        try:
+            await s3_client.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] == '404':
+                return False
+            raise
+        return True
+
+    async def _hash_file(self, file: UploadFile) -> tuple[str, int]:
+        """sha256 и размер файла, чтение частями по multipart_chunk_size, затем возврат в начало файла.
+        Отдельный проход перед загрузкой нужен намеренно: ключ объекта - хеш содержимого, и проверка
+        дубликата (HEAD по content_key) должна пройти до загрузки, иначе дубликат все равно уйдет в s3.
+        Повторно читается локальный файл UploadFile (SpooledTemporaryFile), а не сеть, поэтому второй
+        проход дешевле лишней загрузки в s3
+        """
+        digest = hashlib.sha256()
+        size = 0
+        while chunk := await file.read(self.multipart_chunk_size):
+            digest.update(chunk)
+            size += len(chunk)
+        await file.seek(0)
+        return digest.hexdigest(), size
 
     async def upload_file(self, file: UploadFile, s3_name: str, bucket='private',
                           filename: tp.Optional[str] = None,
                           ACL='private'):
         """ACL: public-read | private
         MINIO не поддерживает ACL
+        Объект сохраняется под ключом sha256 содержимого (content_key): если такой объект уже есть,
+        повторная загрузка пропускается (deduplicated). Иначе файл читается частями по multipart_chunk_size:
+        если он не уместился в одну часть, загружается через multipart upload
         """
 
-        file_content = await file.read()
         if not filename:
             filename = file.filename
         kind = get_filetype(filename=filename)
-        key = await self._generate_unique_key(filename=filename, bucket=bucket, s3_name=s3_name)
-
-        async with self.get_session(s3_name=s3_name).client as s3_client:
-            response = await s3_client.put_object(
-                Bucket=bucket,
-                Key=key,
-                Body=file_content,
-                ContentType=kind,
-                ACL=ACL
-            )
+        sha256, size = await self._hash_file(file)
+        key = self.content_key(sha256)
+        s3_client = await self.get_session(s3_name=s3_name).get_client()
+
+        deduplicated = await self._object_exists(s3_client=s3_client, bucket=bucket, key=key)
+        response = None
+        if not deduplicated:
+            first_chunk = await file.read(self.multipart_chunk_size)
+            if len(first_chunk) < self.multipart_chunk_size:
+                response = await s3_client.put_object(
+                    Bucket=bucket,
+                    Key=key,
+                    Body=first_chunk,
+                    ContentType=kind,
+                    ACL=ACL
+                )
+            else:
+                response = await self._upload_multipart(
+                    s3_client=s3_client, file=file, first_chunk=first_chunk, bucket=bucket, key=key,
+                    kind=kind, ACL=ACL
+                )
 
         return {
             's3_response': response,
             'filename': key,
             'content_type': kind,
             'bucket': bucket,
-            'ACL': ACL
+            'ACL': ACL,
+            'size': size,
+            'sha256': sha256,
+            'deduplicated': deduplicated
         }
 
-    async def generate_url(self, keys: tp.List[str], s3_name: str, bucket: str = 'private', expires_in=3600):
+    async def _upload_multipart(self, s3_client, file: UploadFile, first_chunk: bytes, bucket: str, key: str,
+                                kind: str, ACL: str) -> dict:
+        """Загрузка частями: в памяти одновременно не больше multipart_concurrency частей,
+        при ошибке незавершенная загрузка отменяется (abort_multipart_upload)
+        """
+        upload = await s3_client.create_multipart_upload(Bucket=bucket, Key=key, ContentType=kind, ACL=ACL)
+        upload_id = upload['UploadId']
+        semaphore = asyncio.Semaphore(self.multipart_concurrency)
+        tasks: list[asyncio.Task] = []
+
+        async def upload_part(part_number: int, body: bytes) -> dict:
+            try:
+                response = await s3_client.upload_part(
+                    Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=body
+                )
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+            finally:
+                semaphore.release()
+
+        try:
+            chunk = first_chunk
+            part_number = 1
+            while chunk:
+                await semaphore.acquire()
+                failed = [x for x in tasks if x.done() and x.exception() is not None]
+                if failed:
+                    semaphore.release()
+                    raise failed[0].exception()
+                tasks.append(asyncio.create_task(upload_part(part_number, chunk)))
+                part_number += 1
+                chunk = await file.read(self.multipart_chunk_size)
+            parts = await asyncio.gather(*tasks)
+            response = await s3_client.complete_multipart_upload(
+                Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': list(parts)}
+            )
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            raise
+        return response
+
+    async def generate_url(self, keys: tp.List[str], s3_name: str, bucket: str = 'private', expires_in=3600,
+                           filenames: tp.Optional[tp.List[str]] = None):
+        """Ссылки на скачивание подписываются локально и переиспользуются до приближения к истечению,
+        сотни ключей за вызов не требуют обращений к s3.
+        filenames - исходные имена файлов (по порядку keys): объекты хранятся под хешем содержимого,
+        поэтому имя для сохранения передается в ссылке (response-content-disposition)
+        """
 
         if type(keys) is str:
             keys = [keys]
+        if type(filenames) is str:
+            filenames = [filenames]
 
-        files_urls = []
-        for key in keys:
-            async with self.get_session(s3_name=s3_name).client as s3_client:
-                response = await s3_client.generate_presigned_url(
-                    'get_object',
-                    Params={'Bucket': bucket, 'Key': key},
-                    ExpiresIn=expires_in
-                )
-                files_urls.append(
-                    {
-                        'key': key,
-                        'url': response
-                    }
-                )
+        urls = self.get_session(s3_name=s3_name).presigned_urls.urls(
+            bucket=bucket, keys=keys, expires_in=expires_in, filenames=filenames
+        )
 
         return {
-            'urls': files_urls
+            'urls': [{'key': key, 'url': url} for key, url in zip(keys, urls)]
         }
 
     async def upload_base64(self, base64_code: str, s3_name: str, bucket: str = 'private', acl: str = 'private'):
@@ -172,19 +367,130 @@ class S3Database:
 
         return resp
 
-    async def get_file_content(self,s3_name: str, filename: str = None, bucket='private') -> bytes:
-        async with self.get_session(s3_name=s3_name).client as s3_client:
-            s3_response = await s3_client.get_object(
-                Bucket=bucket,
-                Key=filename
-            )
-            s3_object_body = s3_response.get('Body')
+    async def open_file(self, s3_name: str, filename: str, bucket='private', byte_range: tp.Optional[str] = None,
+                        if_none_match: tp.Optional[str] = None, if_modified_since: tp.Optional[datetime.datetime] = None,
+                        if_range: tp.Optional[str] = None, chunk_size: int = 64 * 1024) -> S3Object:
+        """Объект для потоковой отдачи: тело не читается в память, а отдается частями по chunk_size.
+        byte_range - заголовок HTTP Range (bytes=...), if_range - ETag: если объект изменился, отдается целиком
+        """
+        s3_client = await self.get_session(s3_name=s3_name).get_client()
+        params = {'Bucket': bucket, 'Key': filename}
+        if byte_range:
+            params['Range'] = byte_range
+            if if_range:
+                params['IfMatch'] = if_range
+        if if_none_match:
+            params['IfNoneMatch'] = if_none_match
+        elif if_modified_since:
+            params['IfModifiedSince'] = if_modified_since
+        try:
+            response = await s3_client.get_object(**params)
+        except ClientError as e:
+            status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+            headers = e.response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+            if status == 304:
+                return S3Object(status=304, headers={'ETag': headers['etag']} if 'etag' in headers else {})
+            if status == 412 and 'IfMatch' in params:
+                return await self.open_file(
+                    s3_name=s3_name, filename=filename, bucket=bucket, if_none_match=if_none_match,
+                    if_modified_since=if_modified_since, chunk_size=chunk_size
+                )
+            if status == 416:
+                size = (await s3_client.head_object(Bucket=bucket, Key=filename))['ContentLength']
+                return S3Object(status=416, headers={'Content-Range': f'bytes */{size}'})
+            raise
+        return S3Object.from_response(response, chunk_size=chunk_size)
+
+    async def iter_file(self, s3_name: str, filename: str, bucket='private', byte_range: tp.Optional[str] = None,
+                        chunk_size: int = 64 * 1024) -> tp.AsyncIterator[bytes]:
+        """Содержимое объекта (или диапазона byte_range) частями по chunk_size"""
+        s3_object = await self.open_file(s3_name=s3_name, filename=filename, bucket=bucket, byte_range=byte_range,
+                                         chunk_size=chunk_size)
+        try:
+            async for chunk in s3_object:
+                yield chunk
+        finally:
+            await s3_object.close()
+
+    async def open_cached(self, s3_name: str, filename: str, bucket='private') -> tp.Optional[tp.BinaryIO]:
+        """Открытый файл объекта из дискового кэша (read-through), None - кэш выключен, объект больше кэша
+        или только что записанный файл вытеснен другим процессом (вызывающий читает объект из s3 напрямую).
+        Запись, проверенная не раньше ttl назад, и объекты с ключом по содержимому (content_key) отдаются
+        без обращения к s3, остальные проверяются условным GET по etag (304 - локальное чтение)
+        """
+        session = self.get_session(s3_name=s3_name)
+        cache = session.disk_cache
+        if cache is None:
+            return None
+        async with cache.lock(bucket, filename):
+            cached = cache.lookup(bucket, filename)
+            if cached is not None and (cached[2] or _content_key.fullmatch(filename)):
+                local = self._open_local(cache, bucket, filename, cached[1])
+                if local is not None:
+                    return local
+                cached = None
+
+            s3_client = await session.get_client()
+            params = {'Bucket': bucket, 'Key': filename}
+            if cached is not None:
+                params['IfNoneMatch'] = cached[0]
+            try:
+                response = await s3_client.get_object(**params)
+            except ClientError as e:
+                if cached is None or e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') != 304:
+                    raise
+                local = self._open_local(cache, bucket, filename, cached[1])
+                if local is not None:
+                    return local
+                response = await s3_client.get_object(Bucket=bucket, Key=filename)
+
+            s3_object = S3Object.from_response(response, chunk_size=1024 * 1024)
+            if s3_object.content_length > cache.max_bytes:
+                await s3_object.close()
+                return None
+            path = await cache.store(bucket, filename, response['ETag'], s3_object)
+            # запись уже самая новая и проверенная, попаданием не считается
+            return self._open_local(cache, bucket, filename, path, touch=False)
+
+    @staticmethod
+    def _open_local(cache: DiskCache, bucket: str, filename: str, path: str,
+                    touch: bool = True) -> tp.Optional[tp.BinaryIO]:
+        try:
+            local = open(path, 'rb')
+        except FileNotFoundError:
+            # вытеснен другим процессом с тем же каталогом кэша
+            cache.discard(bucket, filename)
+            return None
+        if touch:
+            cache.touch(bucket, filename)
+        return local
+
+    async def open_local_file(self, s3_name: str, filename: str, bucket='private') -> tp.BinaryIO:
+        """Открытый локальный файл с содержимым объекта: из дискового кэша или, без кэша, временный файл.
+        Подходит для отдачи без копирования в память (mmap, os.sendfile, потоковая отправка aiohttp)
+        """
+        local = await self.open_cached(s3_name=s3_name, filename=filename, bucket=bucket)
+        if local is None:
+            local = (await self.get_file(s3_name=s3_name, filename=filename, bucket=bucket)).file
+        return local
 
+    async def get_file_content(self,s3_name: str, filename: str = None, bucket='private') -> bytes:
+        local = await self.open_cached(s3_name=s3_name, filename=filename, bucket=bucket)
+        if local is not None:
+            with local:
+                return await asyncio.to_thread(local.read)
+        s3_client = await self.get_session(s3_name=s3_name).get_client()
+        s3_response = await s3_client.get_object(
+            Bucket=bucket,
+            Key=filename
+        )
+        async with s3_response['Body'] as s3_object_body:
             content = await s3_object_body.read()
         return content
 
     async def get_file(self, s3_name: str, filename: str = None, bucket='private') -> UploadFile:
-        """
+        """Объект пишется частями во временный файл (в памяти до 1 МБ, дальше на диске), без копий в памяти
+
         Пример записи результата в файл:
         import aiofiles
 
@@ -192,20 +498,17 @@ class S3Database:
             content = await file.read()  # async read
             await out_file.write(content)  # async write
         """
-        file_content = await self.get_file_content(filename=filename, s3_name=s3_name, bucket=bucket)
-        file_bytes = io.BytesIO(file_content)
-        file_bytes.seek(0)
-        file_bytes.name = filename
-        file_buffered_reader = io.BufferedReader(file_bytes)
-
-        file = UploadFile(
-            file=file_buffered_reader,
-            filename=filename
-        )
-
+        spool = SpooledTemporaryFile(max_size=1024 * 1024)
+        file = UploadFile(file=spool, filename=filename)
+        try:
+            async for chunk in self.iter_file(s3_name=s3_name, filename=filename, bucket=bucket):
+                await file.write(chunk)
+            await file.seek(0)
+        except BaseException:
+            await file.close()
+            raise
         return file
 
-
 def get_filetype(filename: str):
     kind = mimetypes.guess_type(filename)[0]
 
@@ -0,0 +1,108 @@
+import datetime
+import json
+import typing as tp
+import uuid
+
+import sqlalchemy as sa
+
+
+def serialize_json(obj):
+    if isinstance(obj, datetime.datetime):
+        return obj.strftime('%Y-%m-%d %H:%M:%S')
+    elif isinstance(obj, uuid.UUID):
+        return str(obj)
+    raise TypeError("Type not serializable")
+
+
+def _to_json(v):
+    if type(v) is datetime.datetime:
+        return v.strftime('%Y-%m-%d %H:%M:%S')
+    if type(v) is datetime.date:
+        return v.strftime('%Y-%m-%d')
+    if type(v) is datetime.timedelta:
+        return str(v)
+    if type(v) is dict or type(v) is list:
+        return json.dumps(v, ensure_ascii=False, default=serialize_json)
+    return v
+
+
+def _to_array(v):
+    return str(v).replace('[', '{').replace(']', '}')
+
+
+class ColumnSchema:
+    """Описание столбца таблицы с заранее выбранными функцией приведения значения и типом для CAST"""
+
+    def __init__(self, name: str, data_type: str, udt_name: str, character_maximum_length: tp.Optional[int]):
+        self.name = name
+        self.data_type = data_type
+        self.udt_name = udt_name
+        self.character_maximum_length = character_maximum_length
+
+        type_name = data_type.lower()
+
+        self.cast_type = data_type
+        if type_name == 'character':
+            self.cast_type = f'{data_type}({character_maximum_length})'
+        elif type_name == 'array':
+            self.cast_type = udt_name
+
+        self.sa_type = sa.String
+        if 'integer' in type_name:
+            self.sa_type = sa.Integer
+        if 'bigint' in type_name:
+            self.sa_type = sa.BIGINT
+        if 'numeric' in type_name or 'double' in type_name:
+            self.sa_type = sa.Float
+        if 'bool' in type_name:
+            self.sa_type = sa.Boolean
+
+        if 'char' in type_name:
+            self.coerce: tp.Callable[[tp.Any], tp.Any] = str
+        elif 'bool' in type_name:
+            self.coerce = bool
+        elif 'int' in type_name:
+            self.coerce = int
+        elif 'array' in type_name:
+            self.coerce = _to_array
+        elif 'json' in type_name:
+            self.coerce = _to_json
+        else:
+            self.coerce = str
+
+
+class SchemaRegistry:
+    """Кэш структуры таблиц по ключу (db_name, schema, table)"""
+
+    def __init__(self):
+        self.__tables: dict[tuple[str, str, str], dict[str, ColumnSchema]] = {}
+
+    @staticmethod
+    def split_table_name(table_name: str) -> tuple[str, str]:
+        schema_name, _, table_name = table_name.strip().lower().rpartition('.')
+        return schema_name or 'public', table_name
+
+    def get(self, db_name: str, schema_name: str, table_name: str) -> tp.Optional[dict[str, ColumnSchema]]:
+        return self.__tables.get((db_name, schema_name, table_name))
+
+    def load(self, db_name: str, rows: tp.Iterable[dict[str, tp.Any]]) -> None:
+        """Заполнение реестра строками information_schema.columns"""
+        for row in rows:
+            key = (db_name, row['table_schema'], row['table_name'])
+            self.__tables.setdefault(key, {})[row['column_name']] = ColumnSchema(
+                name=row['column_name'],
+                data_type=row['data_type'],
+                udt_name=row['udt_name'],
+                character_maximum_length=row['character_maximum_length']
+            )
+
+    def invalidate(self, db_name: tp.Optional[str] = None, schema_name: tp.Optional[str] = None,
+                   table_name: tp.Optional[str] = None) -> None:
+        for key in list(self.__tables.keys()):
+            if db_name is not None and key[0] != db_name:
+                continue
+            if schema_name is not None and key[1] != schema_name:
+                continue
+            if table_name is not None and key[2] != table_name:
+                continue
+            del self.__tables[key]
@@ -0,0 +1,73 @@
+import bisect
+import hashlib
+import typing as tp
+
+from sqlalchemy import text
+
+if tp.TYPE_CHECKING:
+    from .sql_database import Database
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode('UTF-8')).digest()[:8], 'big')
+
+
+class ShardMap:
+    """Консистентное хэширование ключа (user_id) на имена баз.
+    При добавлении шарда переезжает только ~1/N ключей
+    """
+
+    def __init__(self, shards: list[str], virtual_nodes: int = 64):
+        if not shards:
+            raise ValueError('Не задано ни одного шарда')
+        self.shards = list(shards)
+        self.__ring: list[tuple[int, str]] = sorted(
+            (_hash(f'{shard}#{ind}'), shard) for shard in self.shards for ind in range(virtual_nodes)
+        )
+        self.__hashes = [x[0] for x in self.__ring]
+
+    def get_shard(self, key: tp.Any) -> str:
+        if len(self.shards) == 1:
+            return self.shards[0]
+        ind = bisect.bisect(self.__hashes, _hash(str(key))) % len(self.__ring)
+        return self.__ring[ind][1]
+
+    def rebalance_plan(self, new_map: "ShardMap", keys: tp.Iterable[tp.Any]) -> dict[tp.Any, tuple[str, str]]:
+        """Ключи, которые при переходе на new_map меняют шард: {key: (старый, новый)}"""
+        plan = {}
+        for key in keys:
+            old_shard, new_shard = self.get_shard(key), new_map.get_shard(key)
+            if old_shard != new_shard:
+                plan[key] = (old_shard, new_shard)
+        return plan
+
+
+async def interleave_sequences(db: "Database", shard_names: list[str]) -> None:
+    """Чередование последовательностей между шардами: шард i выдает id вида k * N + i + 1,
+    начиная выше максимального уже выданного id, чтобы первичные ключи были уникальны между шардами
+    и строки можно было переносить при перебалансировке
+    """
+    shards_count = len(shard_names)
+    if shards_count < 2:
+        return
+    engines = await db.get_engines()
+    sequences: dict[str, dict[str, tuple[int, int]]] = {}
+    for shard_name in shard_names:
+        async with engines[shard_name].connect() as conn:
+            rows = (await conn.execute(text(
+                "SELECT sequencename, COALESCE(last_value, 0), increment_by FROM pg_sequences WHERE schemaname = 'public'"
+            ))).all()
+        for sequence_name, last_value, increment_by in rows:
+            sequences.setdefault(sequence_name, {})[shard_name] = (int(last_value), int(increment_by))
+
+    for sequence_name, shards_state in sequences.items():
+        if len(shards_state) == shards_count and all(x[1] == shards_count for x in shards_state.values()):
+            continue
+        base = max(x[0] for x in shards_state.values())
+        for ind, shard_name in enumerate(shard_names):
+            if shard_name not in shards_state:
+                continue
+            start = base + 1 + (ind + 1 - (base + 1)) % shards_count
+            async with engines[shard_name].begin() as conn:
+                await conn.execute(text(f'ALTER SEQUENCE "{sequence_name}" INCREMENT BY {shards_count}'))
+                await conn.execute(text(f"SELECT setval('\"{sequence_name}\"', {start}, false)"))
@@ -1,105 +1,358 @@
 import copy
-import datetime
-import json
 import typing as tp
 import uuid
-from asyncio import current_task
-from itertools import chain
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from itertools import chain, count
 
 import asyncio
 import sqlalchemy as sa
 from sqlalchemy import text, TextClause
-from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, AsyncSession, async_sessionmaker, \
-    async_scoped_session
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, AsyncSession, async_sessionmaker
 import re
 
-
-def serialize_json(obj):
-    if isinstance(obj, datetime.datetime):
-        return obj.strftime('%Y-%m-%d %H:%M:%S')
-    elif isinstance(obj, uuid.UUID):
-        return str(obj)
-    raise TypeError("Type not serializable")
+from .batch import StatementBatch
+from .columnar import ColumnBatch, records_to_batch
+from .leaks import leak_detector
+from .pagination import KeysetPagination
+from .pool import MonitoredPool, apply_pooler_mode, unique_statement_name
+from .profiler import sql_profiler
+from .registry import ConnectionRegistry
+from .schema_registry import SchemaRegistry, ColumnSchema
 
 
 class DBError(Exception):
     ...
 
 
+class UnitOfWork:
+    """Учет баз, к которым обращался текущий запрос.
+    used - базы, в которых открыта транзакция; written - базы, в которые запрос писал,
+    чтение из них дальше идет только с primary (read-your-writes)
+    read_only - новые транзакции открываются как READ ONLY
+    consistency_key - чей запрос (например user_id): чтение с реплики допускается, только если она догнала
+    последнюю запись этого ключа, None - последнюю запись процесса в базу
+    """
+
+    def __init__(self, read_only: bool = False, consistency_key: tp.Optional[tp.Hashable] = None):
+        self.read_only = read_only
+        self.consistency_key = consistency_key
+        self.used: set[str] = set()
+        self.written: set[str] = set()
+        # сессии запроса: живут в контексте запроса (наследуется дочерними задачами) и удаляются при close
+        self.sessions: dict["DataBaseSession", AsyncSession] = {}
+        # DataLoader-ы запроса (shared.db.loader.get_loader)
+        self.loaders: dict[tp.Hashable, tp.Any] = {}
+
+    async def close(self) -> None:
+        """Закрытие всех сессий запроса с очисткой реестра"""
+        sessions = list(self.sessions.values())
+        self.sessions.clear()
+        for session in sessions:
+            leak_detector.untrack_session(session)
+        if sessions:
+            await asyncio.gather(*[session.close() for session in sessions])
+
+
+unit_of_work: ContextVar[tp.Optional[UnitOfWork]] = ContextVar('unit_of_work', default=None)
+
+
+def get_unit_of_work() -> UnitOfWork:
+    uow = unit_of_work.get()
+    if uow is None:
+        uow = UnitOfWork()
+        unit_of_work.set(uow)
+    return uow
+
+
+def parse_lsn(lsn: tp.Optional[str]) -> int:
+    """Позиция WAL ('16/B374D848') числом, None (не реплика) - 0"""
+    if not lsn:
+        return 0
+    high, low = lsn.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def is_write_statement(statement) -> bool:
+    if isinstance(statement, str):
+        return not statement.lstrip().lower().startswith('select')
+    if isinstance(statement, TextClause):
+        return not statement.text.lstrip().lower().startswith('select')
+    return not getattr(statement, 'is_select', False)
+
+
 class DataBaseSession:
-    def __init__(self, db_params: tp.Dict[str, tp.Any]) -> None:
+    def __init__(self, db_params: tp.Dict[str, tp.Any], name: tp.Optional[str] = None) -> None:
         self.db_params = db_params
+        self.name = name
+        # "transaction" - подключение через PgBouncer в режиме transaction pooling
+        self.pooler_mode = db_params.get('pooler_mode')
         self.__engine = None
-        self.__session = None
+        self.__session_factory = None
+        # позиции WAL после коммитов по consistency_key, ведутся только для баз с репликами (track_write_positions)
+        self.write_positions: tp.Optional[OrderedDict[tp.Hashable, int]] = None
+        self.write_positions_size = 100000
+        self.last_write_position = 0
+        self.__evicted_write_position = 0
 
     @property
     async def engine(self) -> AsyncEngine:
         if self.__engine is None:
-            self.__engine = create_async_engine(**self.db_params)
+            db_params = dict(self.db_params)
+            db_params = apply_pooler_mode(db_params, db_params.pop('pooler_mode', None))
+            max_overflow_limit = db_params.pop('pool_max_overflow_limit', None)
+            target_wait = db_params.pop('pool_target_wait', 0.05)
+            db_params.setdefault('poolclass', MonitoredPool)
+            self.__engine = create_async_engine(**db_params)
+            if isinstance(self.__engine.pool, MonitoredPool):
+                self.__engine.pool.configure_adaptive(max_overflow_limit=max_overflow_limit, target_wait=target_wait)
+            sql_profiler.instrument(self.__engine, name=self.name or str(self.__engine.url))
+            leak_detector.instrument(self.__engine, name=self.name or str(self.__engine.url))
         return self.__engine
 
+    def pool_stats(self) -> dict[str, tp.Any]:
+        """Состояние пула соединений: размер, занятые, overflow, гистограмма ожидания, таймауты"""
+        if self.__engine is None:
+            return {}
+        pool = self.__engine.pool
+        if isinstance(pool, MonitoredPool):
+            return pool.status_dict()
+        return {'status': pool.status()}
+
     @property
     async def session(self) -> AsyncSession:
-        if not self.__session:
-            self.__session = async_scoped_session(
-                session_factory=async_sessionmaker(
+        """Сессия текущего запроса (UnitOfWork в contextvar), создается при первом обращении"""
+        uow = get_unit_of_work()
+        session = uow.sessions.get(self)
+        if session is None:
+            if self.__session_factory is None:
+                self.__session_factory = async_sessionmaker(
                     bind=await self.engine,
                     autocommit=False,
                     autoflush=False,
                     expire_on_commit=False,
                     class_=AsyncSession
-                ),
-                scopefunc=current_task
-            )
-        return self.__session
+                )
+            session = self.__session_factory()
+            uow.sessions[self] = session
+            leak_detector.track_session(session, self.name or 'unnamed')
+        return session
+
+    async def begin(self, statement=None, write: bool = False) -> None:
+        """Отметка об использовании сессии в текущем запросе,
+        при первом обращении в read only запросе транзакция открывается как READ ONLY
+        write - запрос пишет в базу независимо от вида statement (например SELECT с DML в CTE)
+        """
+        uow = get_unit_of_work()
+        if self.name not in uow.used:
+            uow.used.add(self.name)
+            if uow.read_only:
+                await (await self.session).connection(execution_options={"postgresql_readonly": True})
+        if write or (statement is not None and is_write_statement(statement)):
+            uow.written.add(self.name)
 
     async def execute(self, *args, **kwargs) -> tp.Any:
+        await self.begin(args[0] if args else kwargs.get('statement'))
         return await (await self.session).execute(*args, **kwargs)
 
     async def commit(self) -> None:
         await (await self.session).commit()
+        if self.write_positions is not None:
+            lsn = (await (await self.session).execute(text('SELECT pg_current_wal_lsn()::text'))).scalar()
+            self.remember_write_position(get_unit_of_work().consistency_key, parse_lsn(lsn))
+
+    def track_write_positions(self) -> None:
+        """Запоминать позицию WAL после каждого коммита (база с репликами)"""
+        if self.write_positions is None:
+            self.write_positions = OrderedDict()
+
+    def remember_write_position(self, key: tp.Optional[tp.Hashable], position: int) -> None:
+        self.last_write_position = max(self.last_write_position, position)
+        if key is None or self.write_positions is None:
+            return
+        self.write_positions[key] = max(self.write_positions.get(key, 0), position)
+        self.write_positions.move_to_end(key)
+        while len(self.write_positions) > self.write_positions_size:
+            _, evicted = self.write_positions.popitem(last=False)
+            self.__evicted_write_position = max(self.__evicted_write_position, evicted)
+
+    def write_position(self, key: tp.Optional[tp.Hashable]) -> int:
+        """Позиция WAL, которую реплика должна воспроизвести, чтобы чтение по key видело его записи"""
+        if self.write_positions is None:
+            return 0
+        if key is None:
+            return self.last_write_position
+        # для вытесненных ключей - самая поздняя из вытесненных позиций
+        return self.write_positions.get(key, self.__evicted_write_position)
 
     async def close(self) -> None:
-        await (await self.session).close()
+        session = get_unit_of_work().sessions.pop(self, None)
+        if session is not None:
+            leak_detector.untrack_session(session)
+            await session.close()
 
     async def rollback(self) -> None:
         await (await self.session).rollback()
 
+    async def prepare(self, xid: str) -> None:
+        """Первая фаза двухфазного коммита"""
+        await (await self.session).execute(text(f"PREPARE TRANSACTION '{xid}'"))
+
+    async def finish_prepared(self, xid: str, commit: bool = True) -> None:
+        """Вторая фаза двухфазного коммита, выполняется вне транзакции"""
+        async with (await self.engine).connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text(f"{'COMMIT' if commit else 'ROLLBACK'} PREPARED '{xid}'"))
+            if commit and self.write_positions is not None:
+                lsn = (await conn.execute(text('SELECT pg_current_wal_lsn()::text'))).scalar()
+                self.remember_write_position(get_unit_of_work().consistency_key, parse_lsn(lsn))
+
+    async def shutdown(self) -> None:
+        """Закрытие пула соединений движка при остановке приложения"""
+        if self.__engine is not None:
+            await self.__engine.dispose()
+            self.__engine = None
+            self.__session_factory = None
+
     async def run_sync(self, func: tp.Callable, *args, **kwargs) -> tp.Any:
         async with (await self.engine).begin() as conn:
             await conn.run_sync(func, *args, **kwargs)
 
+    async def copy_records_to_stage(self, stage_table: str, columns: list[str], records: tp.Iterable[tuple]) -> None:
+        """Создание временной текстовой таблицы в текущей транзакции и загрузка в нее строк через COPY"""
+        columns_str = ', '.join([f'"{k}" TEXT' for k in columns])
+        await self.begin(text('COPY'))
+        await self.execute(text(f'CREATE TEMP TABLE "{stage_table}" ({columns_str}) ON COMMIT DROP'))
+        connection = await (await self.session).connection()
+        raw_connection = (await connection.get_raw_connection()).driver_connection
+        await raw_connection.copy_records_to_table(stage_table, records=records, columns=columns)
+
+    async def fetch_raw(self, query: str, *args, row_factory: tp.Optional[tp.Callable] = None) -> list:
+        """Запрос напрямую через asyncpg на соединении сессии, без компиляции SQLAlchemy и ORM объектов.
+        query - SQL с позиционными параметрами $1, $2, ..., подготовленные выражения кэшируются asyncpg на соединении
+        row_factory - тип строки (например dataclass), по умолчанию asyncpg.Record
+        """
+        await self.begin(query)
+        connection = await (await self.session).connection()
+        raw_connection = (await connection.get_raw_connection()).driver_connection
+        records = await raw_connection.fetch(query, *args)
+        if row_factory is None:
+            return records
+        return [row_factory(*x) for x in records]
+
+    async def fetch_columns(self, query: tp.Union[str, TextClause], params=None,
+                            chunk_size: tp.Optional[int] = None) -> tp.AsyncIterator[ColumnBatch]:
+        """Чтение результата по колонкам напрямую из записей asyncpg, минуя Row/dict SQLAlchemy.
+        chunk_size - размер пачки для серверного курсора, None - весь результат одной пачкой
+        """
+        if isinstance(query, str):
+            query = text(query)
+        await self.begin(query)
+        connection = await (await self.session).connection()
+        compiled = query.compile(dialect=connection.dialect)
+        bind_params = compiled.construct_params(params or {})
+        args = [bind_params[x] for x in compiled.positiontup or []]
+        raw_connection = (await connection.get_raw_connection()).driver_connection
+
+        # транзакция SQLAlchemy на соединении может быть еще не открыта, а курсору asyncpg она нужна;
+        # внутри открытой транзакции asyncpg создает точку сохранения
+        async with raw_connection.transaction():
+            # за PgBouncer имя выражения должно быть уникальным на общем серверном соединении
+            statement = await raw_connection.prepare(
+                compiled.string, name=unique_statement_name() if self.pooler_mode == 'transaction' else None
+            )
+            attributes = statement.get_attributes()
+            if chunk_size is None:
+                yield records_to_batch(await statement.fetch(*args), attributes)
+                return
+            cursor = await statement.cursor(*args)
+            while True:
+                records = await cursor.fetch(chunk_size)
+                if not records:
+                    break
+                yield records_to_batch(records, attributes)
+
     async def query(self, query: tp.Union[str, TextClause], params=None):
         if isinstance(query, str):
             query = text(query)
+        await self.begin(query)
         result = await (await self.session).execute(query, params=params)
         response = [dict(r._mapping) for r in result]
         return response
 
+    async def stream(self, query: tp.Union[str, TextClause], params=None,
+                     batch_size: int = 1000) -> tp.AsyncIterator[list[dict[str, tp.Any]]]:
+        """Чтение результата через серверный курсор пачками по batch_size строк.
+        Следующая пачка запрашивается только когда потребитель забрал предыдущую
+        """
+        if isinstance(query, str):
+            query = text(query)
+        query = query.execution_options(yield_per=batch_size)
+        await self.begin(query)
+        result = await (await self.session).stream(query, params=params)
+        try:
+            async for partition in result.partitions(batch_size):
+                yield [dict(r._mapping) for r in partition]
+        finally:
+            await result.close()
+
 
 # noinspection SqlResolve
 class Database:
-    column_types_cache = []
+    schema_registry = SchemaRegistry()
+    insert_update_templates_cache: dict[tuple, str] = {}
+    copy_threshold = 1000
+
+    replica_check_interval = 5
 
     def __init__(self, engines_params: list[dict[str, tp.Union[int, str, bool]]]):
+        """engines_params - параметры create_async_engine + name,
+        для реплик дополнительно role="replica", primary=<name основной базы>, max_lag=<допустимое отставание, сек>
+        """
         self.__sessions: dict[str, tp.Optional[DataBaseSession]] = {}
         self.__engines_params = {}
+        self.__replicas: dict[str, list[str]] = {}
+        self.__replicas_max_lag: dict[str, float] = {}
+        # реплика -> (время проверки, отставание в допустимых пределах, воспроизведенная позиция WAL)
+        self.__replicas_state: dict[str, tuple[float, bool, int]] = {}
+        self.__replicas_counter = count()
         for engine_params in engines_params:
             engine_params_ = copy.deepcopy(engine_params)
             name = engine_params_.pop("name")
+            role = engine_params_.pop("role", "primary")
+            primary = engine_params_.pop("primary", None)
+            max_lag = engine_params_.pop("max_lag", 5)
+            if role == "replica":
+                if primary is None:
+                    raise DBError(f'Для реплики {name} не задан primary')
+                self.__replicas.setdefault(primary, []).append(name)
+                self.__replicas_max_lag[name] = max_lag
             self.__engines_params[name] = engine_params_
 
     @property
     async def sessions(self) -> dict[str, tp.Optional[DataBaseSession]]:
         if not self.__sessions:
+            # Движки и пулы общие для всех экземпляров Database в процессе
+            registry = ConnectionRegistry()
             for db_name, engine_params in self.__engines_params.items():
-                self.__sessions[db_name] = DataBaseSession(
-                    db_params=engine_params
+                self.__sessions[db_name] = registry.get_or_create(
+                    key=('db', db_name, str(engine_params.get('url'))),
+                    factory=lambda db_name_=db_name, engine_params_=engine_params: DataBaseSession(
+                        db_params=registry.limit_pool(engine_params_),
+                        name=db_name_
+                    )
                 )
+            for db_name in self.__replicas:
+                self.__sessions[db_name].track_write_positions()
         return self.__sessions
 
+    @property
+    async def primary_sessions(self) -> dict[str, DataBaseSession]:
+        return {k: v for k, v in (await self.sessions).items() if k not in self.__replicas_max_lag}
+
     async def run_sync_batch(self, func: tp.Callable, *args, **kwargs):
-        for db_name, session in (await self.sessions).items():
+        for db_name, session in (await self.primary_sessions).items():
             await session.run_sync(func, *args, **kwargs)
 
     async def run_sync(self,db_name: str, func: tp.Callable, *args, **kwargs):
@@ -108,39 +361,95 @@ class Database:
 
     async def get_engines(self) -> dict[str, AsyncEngine]:
         mapping = {}
-        for db_name, session in (await self.sessions).items():
+        for db_name, session in (await self.primary_sessions).items():
             mapping[db_name] = await session.engine
         return mapping
 
+    async def pool_stats(self) -> dict[str, dict[str, tp.Any]]:
+        return {db_name: session.pool_stats() for db_name, session in (await self.sessions).items()}
+
     async def get_scoped_session(self, db_name: str) -> DataBaseSession:
         return (await self.sessions)[db_name]
 
-    async def get_column_type_cache(self, db_name: str, table_name: str):
-        column_type = list(
-            filter(
-                lambda x: x['db_name'] == db_name and x['table_name'] == table_name,
-                self.column_types_cache
-            )
-        )
-        if column_type:
-            column_type = column_type[0]['structure']
-        return column_type
-
-    async def set_column_type_cache(self, db_name, table_name, structure):
-        self.column_types_cache.append(
-            {
-                'db_name': db_name,
-                'table_name': table_name,
-                'structure': structure
-            }
+    @staticmethod
+    async def commit_two_phase(sessions: list[DataBaseSession]) -> None:
+        """Двухфазный коммит нескольких баз (требует max_prepared_transactions > 0)"""
+        xid_base = uuid.uuid4().hex
+        xids = [f'{xid_base}_{ind}' for ind in range(len(sessions))]
+        results = await asyncio.gather(
+            *[session.prepare(xid) for session, xid in zip(sessions, xids)],
+            return_exceptions=True
         )
+        errors = [x for x in results if isinstance(x, BaseException)]
+        if errors:
+            await asyncio.gather(
+                *[
+                    session.finish_prepared(xid, commit=False)
+                    for session, xid, result in zip(sessions, xids, results)
+                    if not isinstance(result, BaseException)
+                ],
+                return_exceptions=True
+            )
+            raise errors[0]
+        await asyncio.gather(*[session.finish_prepared(xid) for session, xid in zip(sessions, xids)])
+
+    def batch(self, db_name: str) -> StatementBatch:
+        return StatementBatch(db=self, db_name=db_name)
 
-    async def get_column_types(self, table_name, db_name):
-        column_types = await self.get_column_type_cache(db_name=db_name, table_name=table_name)
-        if not column_types:
-            column_types = await self.query(
-                f'''
+    async def get_read_session(self, db_name: str) -> DataBaseSession:
+        """Сессия для чтения: реплика с допустимым отставанием, иначе primary.
+        Если текущий запрос уже писал в db_name - всегда primary. Между запросами (read-your-writes для
+        consistency_key из UnitOfWork) реплика подходит, только если воспроизвела позицию WAL последнего
+        коммита этого ключа, иначе чтение идет в primary, пока реплика не догонит
+        """
+        sessions = await self.sessions
+        replicas = self.__replicas.get(db_name)
+        uow = get_unit_of_work()
+        if not replicas or db_name in uow.written:
+            return sessions[db_name]
+        min_position = sessions[db_name].write_position(uow.consistency_key)
+        start = next(self.__replicas_counter)
+        for ind in range(len(replicas)):
+            replica_name = replicas[(start + ind) % len(replicas)]
+            if await self._replica_is_fresh(replica_name, min_position=min_position):
+                return sessions[replica_name]
+        return sessions[db_name]
+
+    async def _replica_is_fresh(self, replica_name: str, min_position: int = 0) -> bool:
+        checked_at, is_fresh, position = self.__replicas_state.get(replica_name, (0, False, 0))
+        now = time.monotonic()
+        if now - checked_at >= self.replica_check_interval:
+            try:
+                lag, position = await self._check_replica(replica_name)
+                is_fresh = lag <= self.__replicas_max_lag[replica_name]
+            except Exception:
+                is_fresh, position = False, 0
+            self.__replicas_state[replica_name] = (now, is_fresh, position)
+        return is_fresh and position >= min_position
+
+    async def _check_replica(self, replica_name: str) -> tuple[float, int]:
+        """Отставание реплики в секундах и воспроизведенная позиция WAL"""
+        async with (await (await self.sessions)[replica_name].engine).connect() as conn:
+            lag, lsn = (await conn.execute(text(
+                'SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0), '
+                'pg_last_wal_replay_lsn()::text'
+            ))).one()
+        return float(lag), parse_lsn(lsn)
+
+    async def load_schema(self, db_name: tp.Optional[str] = None) -> None:
+        """Загрузка структуры всех таблиц одним запросом к information_schema, вызывается при старте и после DDL"""
+        db_names = [db_name] if db_name is not None else list((await self.primary_sessions).keys())
+        for db_name_ in db_names:
+            session = (await self.sessions)[db_name_]
+            # сессия, открытая только ради чтения схемы (например при старте вне запроса), закрывается,
+            # чтобы соединение не оставалось idle in transaction
+            opened = session not in get_unit_of_work().sessions
+            try:
+                rows = await self.query(
+                    '''
                         SELECT
+                            table_schema,
+                            table_name,
                             column_name,
                             data_type,
                             character_maximum_length,
@@ -148,12 +457,57 @@ class Database:
                         FROM
                             information_schema.columns
                         WHERE
-                            table_name = '{table_name}';
+                            table_schema NOT IN ('pg_catalog', 'information_schema');
                     ''',
-                db_name=db_name
+                    db_name=db_name_
+                )
+            finally:
+                if opened:
+                    await session.close()
+            self.invalidate_schema(db_name=db_name_)
+            self.schema_registry.load(db_name=db_name_, rows=rows)
+
+    def invalidate_schema(self, db_name: tp.Optional[str] = None, table_name: tp.Optional[str] = None) -> None:
+        """Сброс реестра схемы после изменения структуры таблиц,
+        вместе с ним сбрасываются шаблоны insert_update этих таблиц (в них зашиты типы столбцов)
+        """
+        schema_name = None
+        if table_name is not None:
+            schema_name, table_name = self.schema_registry.split_table_name(table_name)
+        self.schema_registry.invalidate(db_name=db_name, schema_name=schema_name, table_name=table_name)
+        for key in list(self.insert_update_templates_cache.keys()):
+            if db_name is not None and key[0] != db_name:
+                continue
+            if table_name is not None and self.schema_registry.split_table_name(key[1]) != (schema_name, table_name):
+                continue
+            del self.insert_update_templates_cache[key]
+
+    async def get_column_types(self, table_name: str, db_name: str) -> dict[str, ColumnSchema]:
+        schema_name, table_name_ = self.schema_registry.split_table_name(table_name)
+        table_schema = self.schema_registry.get(db_name, schema_name, table_name_)
+        if table_schema is None:
+            rows = await self.query(
+                '''
+                    SELECT
+                        table_schema,
+                        table_name,
+                        column_name,
+                        data_type,
+                        character_maximum_length,
+                        udt_name
+                    FROM
+                        information_schema.columns
+                    WHERE
+                        table_schema = :table_schema AND table_name = :table_name;
+                ''',
+                db_name=db_name,
+                params={'table_schema': schema_name, 'table_name': table_name_}
             )
-            self.set_column_type_cache(db_name=db_name, table_name=table_name, structure=column_types)
-        return column_types
+            if not rows:
+                raise DBError(f'Таблица {table_name} не найдена')
+            self.schema_registry.load(db_name=db_name, rows=rows)
+            table_schema = self.schema_registry.get(db_name, schema_name, table_name_)
+        return table_schema
 
     async def query(
             self,
@@ -161,12 +515,25 @@ class Database:
             db_name: str,
             params: dict = None,
             pagination: list[int, int] = None,
+            keyset: KeysetPagination = None,
+            replica: bool = False,
+            columnar: bool = False,
     ):
+        """pagination - [start, end] через LIMIT/OFFSET
+        keyset - keyset пагинация, следующий курсор после выполнения доступен в keyset.next_cursor
+        replica - запрос только читает данные и может быть выполнен на реплике
+        columnar - вернуть ColumnBatch (колонки numpy/array.array) вместо списка словарей
+        """
         if params is None:
             params = dict()
+        if columnar and keyset is not None:
+            raise DBError('keyset пагинация не поддерживается для columnar результата')
 
         # Выбор Базы Данных
-        session = await self.get_scoped_session(db_name=db_name)
+        if replica:
+            session = await self.get_read_session(db_name=db_name)
+        else:
+            session = await self.get_scoped_session(db_name=db_name)
 
         # - pagination
         if pagination:
@@ -177,6 +544,13 @@ class Database:
 
             query += pagination_filter
 
+        # - keyset pagination
+        if keyset is not None:
+            query, params = keyset.apply_to_query(query=query, params=params)
+
+        if columnar:
+            return ColumnBatch.concat([x async for x in session.fetch_columns(query=query, params=params)])
+
         # response = await session.query(query=query, params=params)
         try:
             response = await session.query(
@@ -188,157 +562,93 @@ class Database:
         except Exception as e:
             raise e
 
-        return response
-
-    async def insert(self, **kwargs):
-        return await self.insert_update(insert=True, update=False, **kwargs)
+        if keyset is not None:
+            response = keyset.paginate(response)
 
-    async def update(self, **kwargs):
-        return await self.insert_update(insert=False, update=True, **kwargs)
+        return response
 
-    async def insert_update(self, table_name, values, db_name, constraint=None,
-                            insert=True, update=True, returning=None, return_query=False,
-                            add_query=None, query_select='*'):
-        """
-        если returning != None : ключ для получения возвращаемого значения ['returning_value']  str
-        constraint - значения по которым нужно обновить данные str|list
+    async def stream(
+            self,
+            query: str,
+            db_name: str,
+            params: dict = None,
+            batch_size: int = 1000,
+            batches: bool = False,
+            replica: bool = False,
+    ) -> tp.AsyncIterator[tp.Union[dict[str, tp.Any], list[dict[str, tp.Any]]]]:
+        """Потоковое чтение большого результата без загрузки его целиком в память
+        batches - отдавать пачки строк вместо отдельных строк
         """
+        if params is None:
+            params = dict()
 
-        values = copy.deepcopy(values)
-        if not values:
-            return {'code': 0, 'message': 'Данные не были переданы'}
-
-        # Проверка параметров и конвертации
-        if isinstance(constraint, str):
-            constraint = [constraint]
-
-        if constraint:
-            constraint = [str(x).lower() for x in constraint]
-
-        if not update and not insert:
-            raise DBError('Не включен ни update, ни insert')
-
-        if update is True and constraint is None:
-            raise DBError('Не задан constraint для update')
-
-        if isinstance(returning, str):
-            returning = [returning]
-
-        if isinstance(values, dict):
-            values = [values]
-
-        for row_ind, value_row in enumerate(values):
-            values[row_ind] = {k.lower(): v for k, v in value_row.items()}
+        if replica:
+            session = await self.get_read_session(db_name=db_name)
+        else:
+            session = await self.get_scoped_session(db_name=db_name)
+        async for partition in session.stream(query=query, params=params, batch_size=batch_size):
+            if batches:
+                yield partition
+            else:
+                for row in partition:
+                    yield row
+
+    async def fetch(
+            self,
+            query: str,
+            db_name: str,
+            *args,
+            row_factory: tp.Optional[tp.Callable] = None,
+            replica: bool = False,
+    ) -> list:
+        """Быстрый путь для горячих точечных запросов: SQL с $1, $2, ... выполняется драйвером напрямую.
+        Строки - asyncpg.Record или row_factory(*record)
+        """
+        if replica:
+            session = await self.get_read_session(db_name=db_name)
+        else:
+            session = await self.get_scoped_session(db_name=db_name)
+        return await session.fetch_raw(query, *args, row_factory=row_factory)
 
-        # Все используемые ключи - названия столбцов
-        all_values_keys = set(chain.from_iterable(values))
-        if constraint is not None:
-            all_values_keys = all_values_keys | set(constraint)
-        all_values_keys = list(all_values_keys)
-        all_values_keys = [str(x).strip().lower() for x in all_values_keys]
-        used_columns = []
-
-        # Получение данных о столбцах через алхимию
-        column_types = await self.get_column_types(db_name=db_name, table_name=table_name)
-
-        columns_data = {x['column_name']: x for x in column_types}
-        udt_names = {x['column_name']: x['udt_name'] for x in column_types}
-        column_types = {x['column_name']: x['data_type'] for x in column_types}
-        for col_name in all_values_keys:
-            col_name = str(col_name).strip().lower()
-            col_type = sa.String
-            if column_types.get(col_name) is None and column_types.get(col_name.lower()) is None:
-                raise DBError(f'Столбец "{col_name}" не задан')
-            col_type_name = column_types[col_name].lower()
-
-            if 'integer' in col_type_name:
-                col_type = sa.Integer
-            if 'bigint' in col_type_name:
-                col_type = sa.BIGINT
-            if 'numeric' in col_type_name or 'double' in col_type_name:
-                col_type = sa.Float
-            if 'bool' in col_type_name:
-                col_type = sa.Boolean
-
-            used_columns.append(sa.column(col_name, col_type))
-
-        # Приведение типа данных CHAR к CHAR(int)
-        column_types = {
-            k: v if v != 'character' else f'''{v}({columns_data[k]['character_maximum_length']})''' for k, v in
-            column_types.items()
-        }
+    async def fetchrow(
+            self,
+            query: str,
+            db_name: str,
+            *args,
+            row_factory: tp.Optional[tp.Callable] = None,
+            replica: bool = False,
+    ) -> tp.Optional[tp.Any]:
+        result = await self.fetch(query, db_name, *args, row_factory=row_factory, replica=replica)
+        return result[0] if result else None
+
+    async def stream_columns(
+            self,
+            query: str,
+            db_name: str,
+            params: dict = None,
+            chunk_size: int = 100000,
+            replica: bool = False,
+    ) -> tp.AsyncIterator[ColumnBatch]:
+        """Потоковое чтение по колонкам пачками по chunk_size строк для векторной агрегации"""
+        if replica:
+            session = await self.get_read_session(db_name=db_name)
+        else:
+            session = await self.get_scoped_session(db_name=db_name)
+        async for batch in session.fetch_columns(query=query, params=params or {}, chunk_size=chunk_size):
+            yield batch
 
-        extra_columns = list(set(all_values_keys) - set(column_types.keys()))
-        if extra_columns:
-            start_text = 'Столбец'
-            if len(extra_columns) > 1:
-                start_text = 'Столбцы'
-            raise DBError(f'''{start_text} {', '.join([
-                f'"{x}"' for x in extra_columns
-            ])} не заданы в {table_name}''')
+    async def insert(self, **kwargs):
+        return await self.insert_update(insert=True, update=False, **kwargs)
 
-        # Формирование пар ключ-значение
-        column_types_to_change = dict()
-        for val_ind, value in enumerate(values):
-            for k in all_values_keys:
-                v = value.get(k)
-                if type(v) is datetime.datetime:
-                    value[k] = v.strftime('%Y-%m-%d %H:%M:%S')
-                if type(v) is datetime.date:
-                    value[k] = v.strftime('%Y-%m-%d')
-                if type(v) is datetime.timedelta:
-                    value[k] = str(v)
-                if type(v) is dict or type(v) is list:
-                    value[k] = json.dumps(v, ensure_ascii=False, default=serialize_json)
-
-                if v is not None:
-                    if 'char' in column_types[k].lower():
-                        value[k] = str(v)
-                    elif 'bool' in column_types[k].lower():
-                        value[k] = bool(v)
-                    elif 'int' in column_types[k].lower():
-                        value[k] = int(v)
-                    elif 'array' in column_types[k].lower():
-                        value[k] = str(v).replace('[', '{').replace(']', '}')
-                        column_types_to_change[k] = udt_names[k]
-                    elif 'json' in column_types[k].lower():
-                        pass
-                    else:
-                        value[k] = str(v)
-
-        for k, udt_name in column_types_to_change.items():
-            column_types[k] = udt_name
+    async def update(self, **kwargs):
+        return await self.insert_update(insert=False, update=True, **kwargs)
 
-        # Формирование запроса
+    @staticmethod
+    def _build_insert_update_body(table_name, all_values_keys, column_types, constraint, returning,
+                                  insert, update, query_select) -> str:
+        """Формирование UPD/INS части запроса insert_update поверх CTE DATA"""
         query = ''
 
-        # Данные на входе - DATA
-        # применение параметризованного построения запроса
-        session = await self.get_scoped_session(db_name=db_name)
-
-        values_list = [
-            [v[k] for k in all_values_keys] for v in values
-        ]
-        values_clause = sa.values(
-            *used_columns,
-            name="DATA",
-        ).data(values_list).compile(
-            session.engine,
-            dialect=sa.dialects.postgresql.dialect(),
-            compile_kwargs={"literal_binds": True}
-        )
-
-        values_clause = re.sub("%%", "%", str(values_clause))
-        values_clause = values_clause.replace('\\\\', '\\')
-
-        statement = f"""\
-           WITH DATA({', '.join([f'"{k}"' for k in all_values_keys])})  AS (
-           {values_clause}
-           ),
-
-           """
-        query += statement
-
         # Обновление данных по совпадающим constraint
         if update:
             query += f'\nUPD AS ('
@@ -403,6 +713,153 @@ class Database:
         else:
             query += f'''\nSELECT; '''
 
+        return query
+
+    async def insert_update(self, table_name, values, db_name, constraint=None,
+                            insert=True, update=True, returning=None, return_query=False,
+                            add_query=None, query_select='*', parametrized=False, copy_threshold=None):
+        """
+        если returning != None : ключ для получения возвращаемого значения ['returning_value']  str
+        constraint - значения по которым нужно обновить данные str|list
+        parametrized - значения передаются bind-параметрами (unnest массивов), текст запроса кэшируется
+        copy_threshold - с какого количества строк данные загружаются через COPY во временную таблицу
+        """
+
+        values = copy.deepcopy(values)
+        if not values:
+            return {'code': 0, 'message': 'Данные не были переданы'}
+
+        # Проверка параметров и конвертации
+        if isinstance(constraint, str):
+            constraint = [constraint]
+
+        if constraint:
+            constraint = [str(x).lower() for x in constraint]
+
+        if not update and not insert:
+            raise DBError('Не включен ни update, ни insert')
+
+        if update is True and constraint is None:
+            raise DBError('Не задан constraint для update')
+
+        if isinstance(returning, str):
+            returning = [returning]
+
+        if isinstance(values, dict):
+            values = [values]
+
+        for row_ind, value_row in enumerate(values):
+            values[row_ind] = {k.lower(): v for k, v in value_row.items()}
+
+        # Все используемые ключи - названия столбцов
+        all_values_keys = set(chain.from_iterable(values))
+        if constraint is not None:
+            all_values_keys = all_values_keys | set(constraint)
+        all_values_keys = list(all_values_keys)
+        all_values_keys = sorted(str(x).strip().lower() for x in all_values_keys)
+
+        # Получение данных о столбцах из реестра схемы
+        table_schema = await self.get_column_types(db_name=db_name, table_name=table_name)
+
+        extra_columns = [x for x in all_values_keys if x not in table_schema]
+        if extra_columns:
+            start_text = 'Столбец'
+            if len(extra_columns) > 1:
+                start_text = 'Столбцы'
+            raise DBError(f'''{start_text} {', '.join([
+                f'"{x}"' for x in extra_columns
+            ])} не заданы в {table_name}''')
+
+        columns = [table_schema[k] for k in all_values_keys]
+        used_columns = [sa.column(column.name, column.sa_type) for column in columns]
+        column_types = {column.name: column.cast_type for column in columns}
+
+        # Приведение значений функциями, заранее подобранными под тип столбца
+        for value in values:
+            for column in columns:
+                v = value.get(column.name)
+                value[column.name] = None if v is None else column.coerce(v)
+
+        # Формирование запроса
+        session = await self.get_scoped_session(db_name=db_name)
+
+        if copy_threshold is None:
+            copy_threshold = self.copy_threshold
+        stage_table = None
+
+        if not return_query and len(values) >= copy_threshold:
+            # Большие пачки передаются через COPY во временную таблицу, DATA читается из нее
+            # временная таблица живет в схеме pg_temp, поэтому имя строится без схемы исходной таблицы
+            stage_table = f'stage_{table_name.rsplit(".", 1)[-1].strip(chr(34))[:40]}_{uuid.uuid4().hex[:8]}'
+            statement = f"""\
+           WITH DATA({', '.join([f'"{k}"' for k in all_values_keys])})  AS (
+           SELECT {', '.join([f'"{k}"' for k in all_values_keys])} FROM "{stage_table}"
+           ),
+
+           """
+            query = statement + self._build_insert_update_body(
+                table_name=table_name, all_values_keys=all_values_keys, column_types=column_types,
+                constraint=constraint, returning=returning, insert=insert, update=update,
+                query_select=query_select
+            )
+            params = None
+        elif parametrized:
+            # Шаблон запроса не зависит от значений - кэшируется по форме запроса,
+            # значения передаются массивами через unnest, что позволяет asyncpg переиспользовать prepared statement
+            template_key = (
+                db_name, table_name, tuple(all_values_keys), tuple(constraint or ()), tuple(returning or ()),
+                insert, update, query_select
+            )
+            query = self.insert_update_templates_cache.get(template_key)
+            if query is None:
+                unnest_args = ', '.join([f'CAST(:p_{ind} AS TEXT[])' for ind in range(len(all_values_keys))])
+                statement = f"""\
+           WITH DATA({', '.join([f'"{k}"' for k in all_values_keys])})  AS (
+           SELECT * FROM unnest({unnest_args})
+           ),
+
+           """
+                query = statement + self._build_insert_update_body(
+                    table_name=table_name, all_values_keys=all_values_keys, column_types=column_types,
+                    constraint=constraint, returning=returning, insert=insert, update=update,
+                    query_select=query_select
+                )
+                self.insert_update_templates_cache[template_key] = query
+
+            params = {
+                f'p_{ind}': [None if v.get(k) is None else str(v[k]) for v in values]
+                for ind, k in enumerate(all_values_keys)
+            }
+        else:
+            # Данные на входе - DATA
+            values_list = [
+                [v[k] for k in all_values_keys] for v in values
+            ]
+            values_clause = sa.values(
+                *used_columns,
+                name="DATA",
+            ).data(values_list).compile(
+                session.engine,
+                dialect=sa.dialects.postgresql.dialect(),
+                compile_kwargs={"literal_binds": True}
+            )
+
+            values_clause = re.sub("%%", "%", str(values_clause))
+            values_clause = values_clause.replace('\\\\', '\\')
+
+            statement = f"""\
+           WITH DATA({', '.join([f'"{k}"' for k in all_values_keys])})  AS (
+           {values_clause}
+           ),
+
+           """
+            query = statement + self._build_insert_update_body(
+                table_name=table_name, all_values_keys=all_values_keys, column_types=column_types,
+                constraint=constraint, returning=returning, insert=insert, update=update,
+                query_select=query_select
+            )
+            params = None
+
         if add_query:
             query += str(add_query)
 
@@ -410,7 +867,17 @@ class Database:
             return query
 
         try:
-            response = await self.query(query, db_name=db_name)
+            if stage_table is not None:
+                await session.copy_records_to_stage(
+                    stage_table=stage_table,
+                    columns=all_values_keys,
+                    records=(
+                        tuple(None if v.get(k) is None else str(v[k]) for k in all_values_keys) for v in values
+                    )
+                )
+            response = await self.query(query, db_name=db_name, params=params)
+            if stage_table is not None:
+                await session.execute(text(f'DROP TABLE IF EXISTS "{stage_table}"'))
         except Exception as e:
             raise DBError(f'Ошибка вставки значения в таблицу {table_name}: {str(e)}')
 
@@ -1,10 +1,12 @@
+import asyncio
+
 from authlib.jose import RSAKey, jwt
-from fastapi import Depends, Security, HTTPException
+from fastapi import Depends, Security, HTTPException, Request
 from fastapi.security import APIKeyHeader
 from starlette import status
 
 from shared.db.s3 import S3Database
-from shared.db.sql_database import Database
+from shared.db.sql_database import Database, UnitOfWork, unit_of_work
 import typing as tp
 
 
@@ -17,34 +19,34 @@ class S3Dependency:
 
 
 class DbDependency:
-    def __init__(self, engines_params: list[dict[str, tp.Union[int, str, bool]]]):
+    def __init__(self, engines_params: list[dict[str, tp.Union[int, str, bool]]],
+                 read_only_methods: tp.Iterable[str] = (), two_phase: bool = False):
+        """read_only_methods - HTTP методы, для которых транзакции открываются как READ ONLY
+        two_phase - двухфазный коммит, если запрос писал больше чем в одну базу
+        """
         self.db = Database(engines_params)
+        self.read_only_methods = {x.upper() for x in read_only_methods}
+        self.two_phase = two_phase
 
-    async def __call__(self) -> Database:
-
+    async def __call__(self, request: Request) -> Database:
+        uow = UnitOfWork(read_only=request.method in self.read_only_methods)
+        unit_of_work.set(uow)
+        sessions = await self.db.sessions
         try:
             yield self.db
-            to_commit = []
-            for db_name, session in (await self.db.sessions).items():
-                await session.commit()
-            #     to_commit.append(session.commit())
-            # if to_commit:
-            #     await asyncio.gather(*to_commit)
+            # commit только для баз, в которые были записи, остальные транзакции закрываются при close
+            to_commit = [sessions[x] for x in uow.written if x in sessions]
+            if self.two_phase and len(to_commit) > 1:
+                await self.db.commit_two_phase(to_commit)
+            elif to_commit:
+                await asyncio.gather(*[session.commit() for session in to_commit])
         except Exception as e:
-            to_rollback = []
-            for db_name, session in (await self.db.sessions).items():
-                await session.rollback()
-            #     to_rollback.append(session.rollback())
-            # if to_rollback:
-            #     await asyncio.gather(*to_rollback)
+            to_rollback = [sessions[x].rollback() for x in uow.used if x in sessions]
+            if to_rollback:
+                await asyncio.gather(*to_rollback, return_exceptions=True)
             raise e
         finally:
-            to_close = []
-            for db_name, session in (await self.db.sessions).items():
-                await session.close()
-            #     to_close.append(session.close())
-            # if to_close:
-            #     await asyncio.gather(*to_close)
+            await uow.close()
 
 
 class User:
@@ -0,0 +1,97 @@
+import asyncio
+
+from conftest import column
+from shared.db.sql_database import Database
+
+
+def load_chat_table(db, value_type: str = 'integer'):
+    db.schema_registry.load(db_name='test', rows=[
+        column('chat', 'chat_id', 'integer'),
+        column('chat', 'user_id', 'integer'),
+        column('chat', 'value', value_type),
+        column('chat', 'language', 'character varying'),
+    ])
+
+
+def test_literal_path_inlines_values(db):
+    load_chat_table(db)
+    query = asyncio.run(db.insert_update(
+        table_name='chat', values=[{'chat_id': 1, 'user_id': 2, 'language': "it's"}], db_name='test',
+        constraint='chat_id', return_query=True
+    ))
+    assert 'VALUES' in query
+    assert "'it''s'" in query
+    assert 'unnest' not in query
+    assert 'd.user_id::integer' in query
+    assert not Database.insert_update_templates_cache
+
+
+def test_parametrized_path_uses_unnest_and_cached_template(db):
+    load_chat_table(db)
+    db.session.rows = [{'chat_id': 1}]
+    result = asyncio.run(db.insert_update(
+        table_name='chat', values=[{'chat_id': 1, 'user_id': 2}, {'chat_id': 3, 'user_id': None}], db_name='test',
+        constraint='chat_id', returning='chat_id', parametrized=True
+    ))
+    assert result['returning_value'] == 1
+    kind, query, params = db.session.calls[-1]
+    assert kind == 'query'
+    assert 'unnest(CAST(:p_0 AS TEXT[]), CAST(:p_1 AS TEXT[]))' in query
+    assert params == {'p_0': ['1', '3'], 'p_1': ['2', None]}
+
+    # другие значения той же формы - тот же текст запроса из кэша шаблонов
+    asyncio.run(db.insert_update(
+        table_name='chat', values=[{'chat_id': 5, 'user_id': 6}], db_name='test',
+        constraint='chat_id', returning='chat_id', parametrized=True
+    ))
+    assert db.session.calls[-1][1] == query
+    assert len(Database.insert_update_templates_cache) == 1
+
+
+def test_schema_invalidation_drops_templates(db):
+    load_chat_table(db)
+    values = [{'chat_id': 1, 'value': 2}]
+    asyncio.run(db.insert_update(
+        table_name='public.chat', values=values, db_name='test', constraint='chat_id', parametrized=True
+    ))
+    assert 'd.value::integer' in db.session.calls[-1][1]
+
+    # ALTER TABLE chat ALTER COLUMN value TYPE bigint
+    db.invalidate_schema(db_name='test', table_name='chat')
+    assert not Database.insert_update_templates_cache
+    load_chat_table(db, value_type='bigint')
+    asyncio.run(db.insert_update(
+        table_name='public.chat', values=values, db_name='test', constraint='chat_id', parametrized=True
+    ))
+    assert 'd.value::bigint' in db.session.calls[-1][1]
+
+
+def test_schema_invalidation_keeps_other_tables_templates(db):
+    load_chat_table(db)
+    db.schema_registry.load(db_name='test', rows=[column('file', 'file_id', 'integer')])
+    asyncio.run(db.insert_update(
+        table_name='chat', values=[{'chat_id': 1}], db_name='test', insert=True, update=False, parametrized=True
+    ))
+    asyncio.run(db.insert_update(
+        table_name='file', values=[{'file_id': 1}], db_name='test', insert=True, update=False, parametrized=True
+    ))
+    db.invalidate_schema(db_name='test', table_name='chat')
+    assert [x[1] for x in Database.insert_update_templates_cache] == ['file']
+
+
+def test_copy_path_loads_stage_table(db):
+    load_chat_table(db)
+    result = asyncio.run(db.insert_update(
+        table_name='public.chat', values=[{'chat_id': 1, 'language': 'ru'}, {'chat_id': 2, 'language': None}],
+        db_name='test', constraint='chat_id', copy_threshold=2
+    ))
+    assert result['code'] == 1
+    (copy, stage_table, columns, records), (query, text, params), (execute, drop) = db.session.calls
+    assert copy == 'copy'
+    # временная таблица без схемы исходной таблицы
+    assert stage_table.startswith('stage_chat_')
+    assert columns == ['chat_id', 'language']
+    assert records == [('1', 'ru'), ('2', None)]
+    assert f'FROM "{stage_table}"' in text
+    assert not params
+    assert drop == f'DROP TABLE IF EXISTS "{stage_table}"'
@@ -0,0 +1,89 @@
+import datetime
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import declarative_base
+
+from shared.db.pagination import CursorError, KeysetPagination, decode_cursor, encode_cursor
+
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = 'item'
+    item_id = sa.Column(sa.Integer, primary_key=True)
+    created = sa.Column(sa.DateTime)
+
+
+def test_cursor_round_trip_keeps_datetime():
+    values = [datetime.datetime(2025, 1, 2, 3, 4, 5), 7, 'a']
+    assert decode_cursor(encode_cursor(values)) == values
+
+
+@pytest.mark.parametrize('cursor', ['not base64!', 'eyJhIjoxfQ=='])
+def test_invalid_cursor(cursor):
+    with pytest.raises(CursorError):
+        decode_cursor(cursor)
+
+
+def test_cursor_must_match_order_by():
+    with pytest.raises(CursorError):
+        KeysetPagination(order_by=['created', 'item_id'], cursor=encode_cursor([1])).cursor_values
+
+
+def test_pages_follow_each_other():
+    rows = [{'item_id': x} for x in range(1, 8)]
+    seen = []
+    cursor = None
+    while True:
+        keyset = KeysetPagination(order_by='item_id', cursor=cursor, limit=3)
+        query, params = keyset.apply_to_query('SELECT item_id FROM item;', {})
+        # выполнение запроса: условие по курсору и LIMIT limit + 1
+        after = params.get('keyset_0', 0)
+        page = keyset.paginate([x for x in rows if x['item_id'] > after][:keyset.limit + 1])
+        seen.extend(x['item_id'] for x in page)
+        cursor = keyset.next_cursor
+        if cursor is None:
+            break
+    assert seen == list(range(1, 8))
+
+
+def test_raw_query_condition():
+    keyset = KeysetPagination(order_by=['created', 'item_id'], cursor=encode_cursor([1, 2]), limit=10,
+                              descending=True)
+    query, params = keyset.apply_to_query('SELECT * FROM item', {'user_id': 5})
+    assert query == (
+        'SELECT * FROM (SELECT * FROM item) AS keyset_q'
+        ' WHERE (keyset_q."created", keyset_q."item_id") < (:keyset_0, :keyset_1)'
+        ' ORDER BY keyset_q."created" DESC, keyset_q."item_id" DESC LIMIT 11'
+    )
+    assert params == {'user_id': 5, 'keyset_0': 1, 'keyset_1': 2}
+
+
+def test_last_page_has_no_cursor():
+    keyset = KeysetPagination(order_by='item_id', limit=3)
+    assert keyset.paginate([{'item_id': 1}, {'item_id': 2}, {'item_id': 3}]) == [
+        {'item_id': 1}, {'item_id': 2}, {'item_id': 3}
+    ]
+    assert keyset.next_cursor is None
+
+
+def test_merge_sorts_rows_from_shards():
+    keyset = KeysetPagination(order_by='item_id', limit=2, descending=True)
+    page = keyset.paginate([{'item_id': 1}, {'item_id': 5}, {'item_id': 3}], merge=True)
+    assert page == [{'item_id': 5}, {'item_id': 3}]
+    assert decode_cursor(keyset.next_cursor) == [3]
+
+
+def test_select_clauses_keep_query_shape():
+    """Разные курсоры дают один и тот же текст запроса - значения идут параметрами"""
+    texts = set()
+    for cursor in (encode_cursor([datetime.datetime(2025, 1, 1), 1]), encode_cursor([datetime.datetime(2025, 2, 1), 9])):
+        keyset = KeysetPagination(order_by=['created', 'item_id'], cursor=cursor, limit=5)
+        criterion, order_by, params = keyset.select_clauses(Item)
+        stmt = sa.select(Item).where(criterion).order_by(*order_by).limit(sa.bindparam('keyset_limit'))
+        texts.add(str(stmt.compile(dialect=postgresql.dialect())))
+        assert params['keyset_limit'] == 6
+    assert len(texts) == 1
+    assert 'WHERE (item.created, item.item_id) > (%(keyset_0)s' in texts.pop()
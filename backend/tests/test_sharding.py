@@ -0,0 +1,39 @@
+import pytest
+
+from shared.db.sharding import ShardMap
+
+SHARDS = ['ai', 'ai_shard_1', 'ai_shard_2']
+
+
+def test_mapping_is_stable():
+    """Ключи не должны менять шард между версиями и процессами (md5, а не hash() с солью процесса)"""
+    shard_map = ShardMap(SHARDS)
+    assert [shard_map.get_shard(x) for x in range(10)] == [
+        'ai_shard_2', 'ai_shard_2', 'ai_shard_2', 'ai', 'ai_shard_1',
+        'ai', 'ai', 'ai_shard_2', 'ai_shard_2', 'ai_shard_1',
+    ]
+
+
+def test_mapping_does_not_depend_on_shards_order():
+    assert all(
+        ShardMap(SHARDS).get_shard(x) == ShardMap(list(reversed(SHARDS))).get_shard(x) for x in range(1000)
+    )
+
+
+def test_key_type_does_not_matter():
+    shard_map = ShardMap(SHARDS)
+    assert all(shard_map.get_shard(x) == shard_map.get_shard(str(x)) for x in range(100))
+
+
+def test_adding_shard_moves_keys_only_to_it():
+    keys = range(10000)
+    plan = ShardMap(SHARDS).rebalance_plan(ShardMap([*SHARDS, 'ai_shard_3']), keys)
+    assert {x[1] for x in plan.values()} == {'ai_shard_3'}
+    # около 1/N ключей
+    assert 0.1 < len(plan) / len(keys) < 0.4
+
+
+def test_single_and_empty():
+    assert ShardMap(['ai']).get_shard(123) == 'ai'
+    with pytest.raises(ValueError):
+        ShardMap([])